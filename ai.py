@@ -0,0 +1,340 @@
+"""Computer opponent: alpha-beta search over rules.Position.
+
+The search is a negamax alpha-beta with iterative deepening, a transposition
+table, MVV-LVA capture ordering, killer moves and a captures-only quiescence
+search at the leaves.  It stops at a depth limit, a time limit or when
+Searcher.stop() is called from another thread, and always answers with the
+best move from the deepest iteration it finished.
+"""
+
+import collections
+import threading
+import time
+
+from rules import BLACK, KING, PAWN, Position, move_to_uci
+from transposition import TranspositionTable
+
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_PLY = 64
+
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+# Centipawn values by piece type
+PIECE_SCORES = (0, 100, 320, 330, 500, 900, 0)
+
+# Piece-square tables from white's point of view, indexed like rules squares
+# (a8 first).  Black pieces read them mirrored with square ^ 56
+PAWN_TABLE = (
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+)
+KNIGHT_TABLE = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+)
+BISHOP_TABLE = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+)
+ROOK_TABLE = (
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0,
+)
+QUEEN_TABLE = (
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20,
+)
+KING_TABLE = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20,
+)
+PIECE_TABLES = (None, PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_TABLE)
+
+# Piece code -> 64 combined material + placement scores, from the owner's point of view
+SQUARE_SCORES = [None] * 15
+for _type in range(PAWN, KING + 1):
+    SQUARE_SCORES[_type] = [PIECE_SCORES[_type] + PIECE_TABLES[_type][square] for square in range(64)]
+    SQUARE_SCORES[BLACK | _type] = [PIECE_SCORES[_type] + PIECE_TABLES[_type][square ^ 56] for square in range(64)]
+
+SearchResult = collections.namedtuple('SearchResult', 'move score depth nodes elapsed')
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def evaluate(position):
+    # Static score in centipawns from the point of view of the side to move
+    score = 0
+    for code, squares in enumerate(position.piece_squares):
+        if squares:
+            table = SQUARE_SCORES[code]
+            total = sum(table[square] for square in squares)
+            score += -total if code & BLACK else total
+    return score if position.turn == 'white' else -score
+
+
+def is_capture(position, move):
+    return position.squares[move[1]] != 0 or (move[1] == position.en_passant_square
+                                              and position.squares[move[0]] & 7 == PAWN)
+
+
+class Searcher:
+    def __init__(self, table_size=1 << 18, table=None, book=None, tablebase=None):
+        # Any object with the TranspositionTable probe/store/new_search methods
+        # can be passed in, such as the shared-memory table used by parallel.py
+        self.table = TranspositionTable(table_size) if table is None else table
+        self.book = book  # book.OpeningBook consulted before searching, or None
+        self.tablebase = tablebase  # tablebase.Tablebase for positions with few pieces, or None
+        self.stop_event = threading.Event()
+        self.nodes = 0
+        self.deadline = None
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+
+    def stop(self):
+        # Safe to call from another thread; the search returns its best move so far
+        self.stop_event.set()
+
+    def search(self, position, max_depth=MAX_PLY, time_limit=None, on_iteration=None):
+        # The caller's position is left untouched; the search works on a copy
+        position = position.copy()
+        self.stop_event.clear()
+        self.table.new_search()
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self.nodes = 0
+        started = time.perf_counter()
+        self.deadline = None if time_limit is None else started + time_limit
+
+        if self.book is not None:
+            move = self.book.choose(position)
+            if move is not None:
+                # Depth 0 marks a book move that took no search
+                return SearchResult(move, 0, 0, 0, time.perf_counter() - started)
+        if self.tablebase is not None:
+            found = self.tablebase.best_move(position)
+            if found is not None:
+                move, outcome = found
+                return SearchResult(move, tablebase_score(outcome, 0), 0, 0, time.perf_counter() - started)
+        root_moves = self._root_moves(position)
+        if not root_moves:
+            return SearchResult(None, 0, 0, 0, 0.0)
+        result = SearchResult(root_moves[0], 0, 0, 0, 0.0)
+        for depth in range(1, min(max_depth, MAX_PLY) + 1):
+            try:
+                score, move = self._search_root(position, root_moves, depth)
+            except SearchTimeout:
+                break
+            result = SearchResult(move, score, depth, self.nodes, time.perf_counter() - started)
+            if on_iteration is not None:
+                on_iteration(result)
+            # Try the best move first in the next, deeper iteration
+            root_moves.remove(move)
+            root_moves.insert(0, move)
+            if abs(score) >= MATE_SCORE - MAX_PLY or len(root_moves) == 1:
+                break
+            if self.deadline is not None and time.perf_counter() > started + (self.deadline - started) / 2:
+                break  # The next iteration would not finish in time anyway
+        return result._replace(nodes=self.nodes, elapsed=time.perf_counter() - started)
+
+    def _root_moves(self, position):
+        return position.legal_moves()
+
+    def _check_time(self):
+        if self.stop_event.is_set() or (self.deadline is not None and time.perf_counter() > self.deadline):
+            raise SearchTimeout()
+
+    def _search_root(self, position, moves, depth):
+        alpha, beta = -INFINITY, INFINITY
+        best_move = moves[0]
+        for move in moves:
+            position.make_move(move)
+            score = -self._negamax(position, depth - 1, -beta, -alpha, 1)
+            position.unmake_move()
+            if score > alpha:
+                alpha, best_move = score, move
+        self.table.store(position.zobrist, (alpha, EXACT, best_move), depth)
+        return alpha, best_move
+
+    def _order(self, position, moves, tt_move, ply):
+        squares = position.squares
+        killers = self.killers[ply]
+
+        def key(move):
+            if move == tt_move:
+                return -100000
+            victim = squares[move[1]]
+            if victim:
+                # MVV-LVA: most valuable victim first, cheapest attacker breaking ties
+                return -10000 - 10 * (victim & 7) + (squares[move[0]] & 7)
+            if move[2] == 'queen':
+                return -9000
+            if move == killers[0] or move == killers[1]:
+                return -5000
+            return 0
+        return sorted(moves, key=key)
+
+    def _negamax(self, position, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self._check_time()
+        if position.halfmove_clock >= 100 or position.repetition_count() > 1:
+            return 0
+        if self.tablebase is not None and sum(map(len, position.piece_squares)) <= self.tablebase.max_pieces:
+            outcome = self.tablebase.probe(position)
+            if outcome is not None:
+                return tablebase_score(outcome, ply)
+        in_check = position.is_king_in_check(position.turn)
+        if in_check:
+            depth += 1  # Don't drop into quiescence while in check
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiesce(position, alpha, beta, ply)
+
+        alpha_start = alpha
+        tt_move = None
+        entry = self.table.probe(position.zobrist)
+        if entry is not None:
+            entry_depth, (score, flag, tt_move) = entry
+            if entry_depth >= depth:
+                score = _score_from_table(score, ply)
+                if flag == EXACT:
+                    return score
+                if flag == LOWER_BOUND:
+                    alpha = max(alpha, score)
+                elif flag == UPPER_BOUND:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        best_score, best_move = -INFINITY, None
+        mover = position.turn
+        for move in self._order(position, position.pseudo_legal_moves(), tt_move, ply):
+            capture = is_capture(position, move)
+            position.make_move(move)
+            if position.is_king_in_check(mover):
+                position.unmake_move()
+                continue
+            score = -self._negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            position.unmake_move()
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if not capture and move != self.killers[ply][0]:
+                            self.killers[ply][1] = self.killers[ply][0]
+                            self.killers[ply][0] = move
+                        break
+
+        if best_move is None:
+            return -MATE_SCORE + ply if in_check else 0  # Checkmate or stalemate
+        if best_score <= alpha_start:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.table.store(position.zobrist, (_score_to_table(best_score, ply), flag, best_move), depth)
+        return best_score
+
+    def _quiesce(self, position, alpha, beta, ply):
+        # Only captures and queen promotions, so the static evaluation is never
+        # taken in the middle of an exchange
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self._check_time()
+        stand_pat = evaluate(position)
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+        squares = position.squares
+        captures = [move for move in position.pseudo_legal_moves()
+                    if squares[move[1]] or move[2] == 'queen']
+        mover = position.turn
+        for move in self._order(position, captures, None, ply):
+            position.make_move(move)
+            if position.is_king_in_check(mover):
+                position.unmake_move()
+                continue
+            score = -self._quiesce(position, -beta, -alpha, ply + 1)
+            position.unmake_move()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+
+def tablebase_score(outcome, ply):
+    # Exact result from the tablebase, scored like a mate found by the search
+    if outcome.wdl == 0:
+        return 0
+    score = MATE_SCORE - ply - outcome.dtm
+    return score if outcome.wdl > 0 else -score
+
+
+def _score_to_table(score, ply):
+    # Mate scores are stored relative to the node, not the root
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def _score_from_table(score, ply):
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
+
+
+def choose_move(position, time_limit=2.0, max_depth=MAX_PLY, book=None, tablebase=None):
+    return Searcher(book=book, tablebase=tablebase).search(position, max_depth=max_depth, time_limit=time_limit).move
+
+
+if __name__ == "__main__":
+    import sys
+    fen = ' '.join(sys.argv[1:])
+    start = Position.from_fen(fen) if fen else Position()
+    searcher = Searcher()
+    searcher.search(start, time_limit=5.0,
+                    on_iteration=lambda result: print(f"depth {result.depth} score {result.score} "
+                                                      f"move {move_to_uci(result.move)} nodes {result.nodes} "
+                                                      f"{result.elapsed:.2f}s"))
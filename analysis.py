@@ -0,0 +1,91 @@
+"""Background analysis for the game window.
+
+AnalysisWorker runs an ai.Searcher in a separate process, so a long search
+never holds the Tk thread's GIL and dragging stays smooth.  analyse() hands
+it a new position.  poll() returns the deepest result so far for the
+latest position, and is meant to be called from an after() loop.
+
+Every request carries a number, and the number of the latest request sits
+in shared memory.  The worker's search checks it like a stop flag, so work
+on a position that has since changed is abandoned at once.  Results from
+it are thrown away as they arrive.
+"""
+
+import multiprocessing
+import queue
+
+from ai import Searcher, SearchTimeout
+from rules import Position
+
+ANALYSIS_SECONDS = 30.0  # Longest time spent on one position
+
+
+class AnalysisSearcher(Searcher):
+    def __init__(self, latest):
+        super().__init__()
+        self.latest = latest  # Shared number of the newest request
+        self.request = 0
+
+    def _check_time(self):
+        if self.latest.value != self.request:
+            raise SearchTimeout()
+        super()._check_time()
+
+
+def _run_worker(requests, results, latest):
+    searcher = AnalysisSearcher(latest)
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        number, fen = request
+        if number != latest.value:
+            continue  # Already replaced by a newer position
+        searcher.request = number
+
+        def report(result, number=number):
+            results.put((number, result.move, result.score, result.depth))
+
+        searcher.search(Position.from_fen(fen), time_limit=ANALYSIS_SECONDS, on_iteration=report)
+
+
+class AnalysisWorker:
+    def __init__(self):
+        context = multiprocessing.get_context('spawn')  # Don't fork a process that is running Tk
+        self.latest = context.Value('q', 0, lock=False)
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(target=_run_worker, args=(self.requests, self.results, self.latest),
+                                       daemon=True)
+        self.process.start()
+        self.number = 0
+        self.result = None  # (move, score, depth) for the latest request
+
+    def analyse(self, position):
+        # Start on the position, abandoning whatever came before
+        self.number += 1
+        self.latest.value = self.number
+        self.result = None
+        self.requests.put((self.number, position.fen()))
+
+    def cancel(self):
+        self.number += 1
+        self.latest.value = self.number
+        self.result = None
+
+    def poll(self):
+        # Newest (move, score, depth) for the current position, or None yet
+        while True:
+            try:
+                number, move, score, depth = self.results.get_nowait()
+            except queue.Empty:
+                return self.result
+            if number == self.number:
+                self.result = (move, score, depth)
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(timeout=1.0)
+        if self.process.is_alive():
+            self.process.terminate()
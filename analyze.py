@@ -0,0 +1,230 @@
+"""Annotate saved games with engine evaluations, move by move.
+
+Every game in the PGN files under a directory is replayed through
+rules.Position, the engine the game window uses.  Each position is searched
+once, to a fixed depth.  Each move gets:
+
+- the evaluation after it, in centipawns from white's point of view, with
+  a forced mate counted as MATE_EVAL and its distance given in moves as
+  mate_in (positive when white mates, negative when black does);
+- the engine's preferred move and how many centipawns the played move gave
+  away against it;
+- a blunder/mistake/inaccuracy flag when that loss is large;
+- whether the move gave check or mate.
+
+Games are spread over a process pool with only a few per worker in
+flight, and the files are read as a stream.  Memory stays flat however
+large the archive is.  Results are written as they complete, one JSON
+object per game (JSONL) or one CSV row per move, in input order.  In CSV
+a game without moves still gets one row, with its error if it has one:
+
+    python analyze.py games/ -o review.jsonl --depth 3 --workers 4
+    python analyze.py games/ --format csv > review.csv
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from ai import MATE_SCORE, MAX_PLY, Searcher
+from pgn import PGNError, move_to_san, open_pgn, parse_san, read_games, start_position
+from rules import move_to_uci
+from tablebase import Tablebase
+
+# Centipawns given away, from the worst flag down
+FLAGS = (('blunder', 200), ('mistake', 100), ('inaccuracy', 50))
+MATE_EVAL = 1000  # Centipawns a forced mate counts as in 'eval' and 'loss'
+CSV_FIELDS = ('source', 'game', 'white', 'black', 'result', 'ply', 'san', 'uci', 'eval', 'mate_in', 'best',
+              'loss', 'flag', 'check', 'mate', 'error')
+
+_searcher = None
+
+
+def _init_worker(tablebase_directory):
+    global _searcher
+    tablebase = Tablebase(tablebase_directory) if tablebase_directory else None
+    _searcher = Searcher(tablebase=tablebase)
+
+
+def game_files(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith('.pgn'):
+                yield os.path.join(root, name)
+
+
+def read_archive(directory):
+    # (source file, game number in the file, Game) for every game, lazily
+    for path in game_files(directory):
+        with open_pgn(path) as lines:
+            for number, game in enumerate(read_games(lines), start=1):
+                yield path, number, game
+
+
+def _evaluate(position, depth):
+    # (score for the side to move, best move) with mate and stalemate scored exactly
+    if not position.has_legal_moves():
+        return (-MATE_SCORE if position.is_king_in_check(position.turn) else 0), None
+    result = _searcher.search(position, max_depth=depth)
+    return result.score, result.move
+
+
+def is_mate_score(score):
+    # Search scores for forced mates sit next to MATE_SCORE; tablebase mates
+    # can be further from it than MAX_PLY, but never near real evaluations
+    return abs(score) >= MATE_SCORE // 2
+
+
+def clamp_score(score):
+    if is_mate_score(score):
+        return MATE_EVAL if score > 0 else -MATE_EVAL
+    return score
+
+
+def mate_in(score):
+    # Moves to mate for the side the score belongs to, negative when it is
+    # the one being mated; None for no forced mate or a position already mated
+    plies = MATE_SCORE - abs(score)
+    if not is_mate_score(score) or plies <= 0:
+        return None
+    moves = (plies + 1) // 2
+    return moves if score > 0 else -moves
+
+
+def flag_for(loss):
+    for name, threshold in FLAGS:
+        if loss >= threshold:
+            return name
+    return None
+
+
+def annotate_game(source, number, game, depth):
+    # One JSON-ready record for the game; an unreadable or illegal move ends
+    # the annotation there and is reported in 'error'
+    record = {'source': source, 'game': number, 'white': game.headers.get('White', '?'),
+              'black': game.headers.get('Black', '?'), 'result': game.result, 'moves': [], 'error': None}
+    try:
+        position = start_position(game)
+    except (ValueError, KeyError, IndexError) as error:
+        record['error'] = f"bad FEN header: {error}"
+        return record
+    # Start every game from an empty table, so its annotations don't depend
+    # on which games this worker analysed before it
+    _searcher.table.clear()
+    _searcher.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+    score, best = _evaluate(position, depth)
+    for ply, text in enumerate(game.moves, start=1):
+        try:
+            move = parse_san(position, text)
+        except PGNError as error:
+            record['error'] = f"ply {ply}: {error}"
+            break
+        mover_is_white = position.turn == 'white'
+        san = move_to_san(position, move)
+        position.make_move(move)
+        reply_score, reply_best = _evaluate(position, depth)
+        # What the mover gave away: the best score they had against the score
+        # they kept, with mates capped so a missed mate isn't 100000 centipawns
+        loss = max(clamp_score(score) + clamp_score(reply_score), 0) if best != move else 0
+        white_score = -reply_score if mover_is_white else reply_score
+        record['moves'].append({
+            'ply': ply,
+            'san': san,
+            'uci': move_to_uci(move),
+            'eval': clamp_score(white_score),
+            'mate_in': mate_in(white_score),
+            'best': move_to_uci(best) if best else None,
+            'loss': loss,
+            'flag': flag_for(loss),
+            'check': san.endswith('+') or san.endswith('#'),
+            'mate': san.endswith('#'),
+        })
+        score, best = reply_score, reply_best
+    return record
+
+
+def _annotate(item, depth):
+    source, number, game = item
+    return annotate_game(source, number, game, depth)
+
+
+def analyze(items, depth=3, workers=None, tablebase_directory=None):
+    # Generator of game records in input order, with at most two games per
+    # worker waiting so neither the input nor the results pile up
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1:
+        _init_worker(tablebase_directory)
+        for item in items:
+            yield _annotate(item, depth)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                initargs=(tablebase_directory,)) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.submit(_annotate, item, depth))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_jsonl(records, out):
+    for record in records:
+        out.write(json.dumps(record) + '\n')
+        yield record
+
+
+def write_csv(records, out):
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    for record in records:
+        # The game's error goes on each of its rows, or on a row of its own
+        # when it has no moves, so no game drops out of the CSV
+        game_fields = {name: record[name] for name in ('source', 'game', 'white', 'black', 'result', 'error')}
+        for move in record['moves']:
+            writer.writerow({**game_fields, **move})
+        if not record['moves']:
+            writer.writerow(game_fields)
+        yield record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Annotate a directory of PGN games with engine analysis.")
+    parser.add_argument('directory', help="directory searched for .pgn files")
+    parser.add_argument('-o', '--output', default='-', help="output file (default: standard output)")
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl',
+                        help="one JSON object per game, or one CSV row per move")
+    parser.add_argument('--depth', type=int, default=3, help="search depth per position, in plies")
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: one per CPU)")
+    parser.add_argument('--tablebase', default=None, help="endgame table directory to consult")
+    args = parser.parse_args(argv)
+    depth = min(max(args.depth, 1), MAX_PLY)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+    started = time.perf_counter()
+    games = moves = flagged = failed = 0
+    try:
+        records = analyze(read_archive(args.directory), depth, args.workers, args.tablebase)
+        writer = write_jsonl if args.format == 'jsonl' else write_csv
+        for record in writer(records, out):
+            games += 1
+            moves += len(record['moves'])
+            flagged += sum(1 for move in record['moves'] if move['flag'] == 'blunder')
+            failed += record['error'] is not None
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"{games} game(s), {moves} moves, {flagged} blunder(s), {failed} game(s) with errors "
+          f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""Validate moves for many positions at once.
+
+Each item is a (position, move) pair.  The position may be a FEN string, a
+67-byte Position.pack() snapshot or a Position; the move may be UCI text
+such as 'e7e8q' or a (start, dest, promotion) tuple.  Every item gets back a
+Validation saying whether the move is legal and, if it is, the Zobrist hash
+of the resulting position and whether it gives check, mate or stalemate.
+
+Items are split into chunks and the chunks are spread over a process pool;
+results come back in input order.  Within a chunk each distinct position is
+decoded once, however many candidate moves it comes with.
+
+    python batch.py --items 20000 --workers 1 4
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import multiprocessing
+import random
+import sys
+import time
+
+from rules import ALL_CASTLING, BLACK, PIECE_NAMES, PROMOTION_PIECES, WHITE, Position, parse_uci
+
+Validation = collections.namedtuple('Validation', 'legal zobrist check checkmate stalemate error')
+ILLEGAL = Validation(False, None, False, False, False, None)
+PIECE_CODES_USED = {code for code, name in enumerate(PIECE_NAMES) if name} | {0}
+
+
+def decode_position(position):
+    if isinstance(position, Position):
+        return position.copy()
+    if isinstance(position, (bytes, bytearray, memoryview)):
+        if len(position) != 67:
+            raise ValueError(f"Packed positions are 67 bytes, got {len(position)}")
+        data = bytes(position)
+        if (any(code not in PIECE_CODES_USED for code in data[:64]) or data[64] not in (WHITE, BLACK)
+                or data[65] > ALL_CASTLING or data[66] > 64):
+            raise ValueError("Invalid packed position")
+        return Position.unpack(data)
+    return Position.from_fen(position)
+
+
+def decode_move(move):
+    if isinstance(move, str):
+        if len(move) not in (4, 5):
+            raise ValueError(f"Invalid UCI move: {move!r}")
+        move = parse_uci(move)
+    start, dest, promotion = move
+    if not (0 <= start < 64 and 0 <= dest < 64) or promotion not in ('',) + PROMOTION_PIECES:
+        raise ValueError(f"Invalid move: {move!r}")
+    return start, dest, promotion
+
+
+def validate_move(position, move):
+    # Checks a single move against a Position without generating the full
+    # move list; the position is left as it was
+    if not position.is_legal(move):
+        return ILLEGAL
+    position.make_move(move)
+    try:
+        check = position.is_king_in_check(position.turn)
+        game_over = not position.has_legal_moves()
+        return Validation(True, position.zobrist, check, check and game_over, game_over and not check, None)
+    finally:
+        position.unmake_move()
+
+
+def validate_chunk(items):
+    decoded = {}  # Position input -> Position, or the error it raised
+    results = []
+    for position, move in items:
+        key = position if isinstance(position, (str, bytes)) else id(position)
+        board = decoded.get(key)
+        if board is None:
+            try:
+                board = decoded[key] = decode_position(position)
+            except (ValueError, KeyError, IndexError) as error:
+                board = decoded[key] = error
+        try:
+            if isinstance(board, Exception):
+                raise board
+            results.append(validate_move(board, decode_move(move)))
+        except (ValueError, KeyError, IndexError) as error:
+            results.append(ILLEGAL._replace(error=str(error) or repr(error)))
+    return results
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class BatchValidator:
+    def __init__(self, workers=None, chunk_size=512):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.pool = None
+        if self.workers > 1:
+            self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+
+    def validate(self, items):
+        # Generator of Validations in the order of the items.  At most a few
+        # chunks per worker are in flight, so items can be a stream
+        chunks = _chunks(items, self.chunk_size)
+        if self.pool is None:
+            for chunk in chunks:
+                yield from validate_chunk(chunk)
+            return
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(self.pool.submit(validate_chunk, chunk))
+            if len(pending) >= 2 * self.workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def validate_batch(items, workers=None, chunk_size=512):
+    with BatchValidator(workers, chunk_size) as validator:
+        return list(validator.validate(items))
+
+
+def random_items(count, seed=0):
+    # Positions from short random games, each with one legal and one
+    # pseudo-legal candidate move, for benchmarking
+    rng = random.Random(seed)
+    items = []
+    while len(items) < count:
+        position = Position()
+        for _ in range(rng.randrange(60)):
+            moves = position.legal_moves()
+            if not moves:
+                break
+            position.make_move(rng.choice(moves))
+        moves = position.legal_moves()
+        if not moves:
+            continue
+        fen = position.fen()
+        items.append((fen, rng.choice(moves)))
+        items.append((fen, rng.choice(position.pseudo_legal_moves())))
+    return items[:count]
+
+
+def benchmark(items, worker_counts, chunk_size=512, out=sys.stdout):
+    rates = {}
+    for workers in worker_counts:
+        with BatchValidator(workers, chunk_size) as validator:
+            started = time.perf_counter()
+            legal = sum(result.legal for result in validator.validate(items))
+            elapsed = time.perf_counter() - started
+        rates[workers] = len(items) / elapsed if elapsed > 0 else 0.0
+        print(f"{workers} worker(s): {len(items)} moves ({legal} legal) in {elapsed:.3f}s "
+              f"({rates[workers]:,.0f} moves/s)", file=out)
+    return rates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark batch move validation.")
+    parser.add_argument('--items', type=int, default=20000, help="number of (position, move) pairs")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, multiprocessing.cpu_count()],
+                        help="worker counts to compare")
+    parser.add_argument('--chunk-size', type=int, default=512, help="items per pool task")
+    args = parser.parse_args(argv)
+    benchmark(random_items(args.items), args.workers, args.chunk_size)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""Opening book: moves played from known positions, looked up by Zobrist hash.
+
+The file is a sorted array of 16-byte big-endian records laid out like a
+Polyglot book entry (key, move, weight, learn).  The key is the
+rules.Position Zobrist hash rather than the Polyglot one.  Records with the
+same key sit next to each other, so a lookup is a binary search over the
+memory-mapped file.  Opening a book reads nothing up front, and processes
+that open the same file share its pages.
+
+    python book.py build games.pgn more.pgn -o book.bin --plies 20
+    python book.py probe --fen "<fen>" --book book.bin
+"""
+
+import argparse
+import collections
+import mmap
+import os
+import random
+import struct
+import sys
+
+from pgn import PGNError, open_pgn, read_games, replay, start_position
+from rules import PROMOTION_PIECES, START_FEN, Position, move_to_uci
+
+RECORD = struct.Struct('>QHHI')  # key, move, weight, learn
+KEY = struct.Struct('>Q')
+PROMOTION_CODES = ('',) + PROMOTION_PIECES
+MAX_WEIGHT = 0xFFFF
+DEFAULT_BOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book.bin')
+
+
+def encode_move(move):
+    start, dest, promotion = move
+    return PROMOTION_CODES.index(promotion) << 12 | dest << 6 | start
+
+
+def decode_move(bits):
+    return (bits & 63, bits >> 6 & 63, PROMOTION_CODES[bits >> 12 & 7])
+
+
+class OpeningBook:
+    def __init__(self, path=DEFAULT_BOOK):
+        self.path = path
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size % RECORD.size:
+                raise ValueError(f"{path} is not a book file: size {size} is not a multiple of {RECORD.size}")
+            # mmap refuses empty files; an empty book simply has no moves
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.count = size // RECORD.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def _first_index(self, key):
+        # Index of the first record whose key is not below the given key
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def entries(self, key):
+        # [(move, weight)] stored for the hash, heaviest first
+        found = []
+        index = self._first_index(key)
+        while index < self.count:
+            entry_key, move, weight, _ = RECORD.unpack_from(self.data, index * RECORD.size)
+            if entry_key != key:
+                break
+            found.append((decode_move(move), weight))
+            index += 1
+        found.sort(key=lambda entry: -entry[1])
+        return found
+
+    def moves(self, position):
+        # Book moves that are legal in the position; a hash collision with
+        # some other position can't make the engine play an illegal move
+        found = self.entries(position.zobrist)
+        if not found:
+            return []
+        legal = position.legal_moves()
+        return [(move, weight) for move, weight in found if move in legal]
+
+    def choose(self, position, rng=random):
+        # A book move picked at random in proportion to its weight, or None
+        moves = self.moves(position)
+        total = sum(weight for _, weight in moves)
+        if not total:
+            return None
+        pick = rng.uniform(0, total)
+        for move, weight in moves:
+            pick -= weight
+            if pick <= 0:
+                return move
+        return moves[-1][0]
+
+
+def open_book(path=DEFAULT_BOOK):
+    # The book at the path, or None when there isn't a usable one
+    try:
+        return OpeningBook(path)
+    except (OSError, ValueError):
+        return None
+
+
+def build_book(pgn_paths, out_path, plies=20, min_count=1):
+    # Each move played in the first plies of the games scores 2 for a win,
+    # 1 for a draw and 0 for a loss of the side that played it, like
+    # Polyglot's builder; moves that never scored are left out
+    scores = collections.Counter()
+    counts = collections.Counter()
+    games = 0
+    for path in pgn_paths:
+        with open_pgn(path) as lines:
+            for game in read_games(lines):
+                points = {'1-0': {'white': 2, 'black': 0}, '0-1': {'white': 0, 'black': 2},
+                          '1/2-1/2': {'white': 1, 'black': 1}}.get(game.result)
+                if points is None:
+                    continue
+                try:
+                    position = start_position(game)
+                except ValueError:
+                    continue  # A [FEN] header that can't be decoded; skip the game
+                key, turn = position.zobrist, position.turn
+                try:
+                    for ply, (move, position) in enumerate(replay(game, position)):
+                        if ply >= plies:
+                            break
+                        scores[key, encode_move(move)] += points[turn]
+                        counts[key, encode_move(move)] += 1
+                        key, turn = position.zobrist, position.turn
+                except PGNError:
+                    pass  # Keep the moves before the bad one
+                games += 1
+
+    entries = sorted(entry for entry, count in counts.items() if count >= min_count and scores[entry])
+    top = max((scores[entry] for entry in entries), default=1)
+    partial = f"{out_path}.{os.getpid()}.tmp"
+    with open(partial, 'wb') as out:
+        for key, move in entries:
+            weight = max(1, scores[key, move] * MAX_WEIGHT // top) if top > MAX_WEIGHT else scores[key, move]
+            out.write(RECORD.pack(key, move, weight, 0))
+    os.replace(partial, out_path)
+    return games, len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query an opening book.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="build a book from PGN files")
+    build.add_argument('pgn', nargs='+', help="PGN files to read")
+    build.add_argument('-o', '--output', default=DEFAULT_BOOK, help="book file to write")
+    build.add_argument('--plies', type=int, default=20, help="moves per game to take, in plies")
+    build.add_argument('--min-count', type=int, default=1, help="leave out moves played fewer times")
+    probe = commands.add_parser('probe', help="list the book moves for a position")
+    probe.add_argument('--fen', default=START_FEN, help="position to look up (default: starting position)")
+    probe.add_argument('--book', default=DEFAULT_BOOK, help="book file to read")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        games, entries = build_book(args.pgn, args.output, args.plies, args.min_count)
+        print(f"{games} game(s), {entries} book entries written to {args.output}")
+        return 0
+    with OpeningBook(args.book) as book:
+        position = Position.from_fen(args.fen)
+        moves = book.moves(position)
+        total = sum(weight for _, weight in moves) or 1
+        for move, weight in moves:
+            print(f"{move_to_uci(move)} {weight} ({100 * weight / total:.1f}%)")
+        if not moves:
+            print("no book moves")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
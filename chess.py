@@ -1,6 +1,22 @@
+import collections
+import logging
+import threading
 import tkinter as tk
-from tkinter import messagebox
-from PIL import Image, ImageTk
+from tkinter import filedialog, messagebox
+
+import instrument
+from ai import MATE_SCORE, MAX_PLY, Searcher
+from analysis import AnalysisWorker
+from book import open_book
+from pgn import PGNError, export_pgn, open_pgn, read_games, replay, start_position
+from rules import Position, move_to_uci, opponent
+from sprites import SpriteCache
+from tablebase import Tablebase
+
+LEGAL_MOVE_CACHE_SIZE = 64  # Positions whose legal moves are kept, enough for undo and redo
+EVAL_BAR_WIDTH = 24
+
+log = logging.getLogger('chessgame')
 
 class MainMenu(tk.Tk):
     def __init__(self):
@@ -14,89 +30,196 @@ class MainMenu(tk.Tk):
         start_button = tk.Button(self, text="Start Game", command=self.start_game)
         start_button.pack()
 
+        computer_button = tk.Button(self, text="Play vs Computer", command=self.start_computer_game)
+        computer_button.pack(pady=10)
+
     def start_game(self):
         self.destroy()
         game = ChessGame()
         game.mainloop()
 
+    def start_computer_game(self):
+        self.destroy()
+        game = ChessGame(ai_color='black')
+        game.mainloop()
+
 
 
 class ChessGame(tk.Tk):
-    def __init__(self):
+    def __init__(self, ai_color=None, ai_time=2.0):
         super().__init__()
         self.title("Chess Game")
-        self.geometry("600x650")
-        self.board = [['' for _ in range(8)] for _ in range(8)]
-        self.piece_images = self.load_piece_images()
+        self.geometry(f"{600 + EVAL_BAR_WIDTH}x650")
+        self.position = Position(setup=False)  # Board, turn, castling and en passant state
+        self.square_size = 600 // 8  # Follows the canvas size, see on_resize
+        self.sprites = SpriteCache()
+        self.sprites.preload(self.square_size)  # Decode while the window is being built
+        self.sprites_ready = False  # Pieces are drawn once the first preload is done, see wait_for_sprites
+        # White's share of the bar grows from the bottom with its winning chances
+        self.eval_bar = tk.Canvas(self, width=EVAL_BAR_WIDTH, bg="black", highlightthickness=0)
+        self.eval_bar.pack(side="right", fill="y")
+        self.eval_fill = self.eval_bar.create_rectangle(0, 0, 0, 0, fill="white", outline="")
+        self.eval_text = self.eval_bar.create_text(EVAL_BAR_WIDTH // 2, 0, text="", fill="gray50",
+                                                   font=('Helvetica', 8))
+        self.eval_fraction = 0.5
+        self.eval_bar.bind("<Configure>", lambda event: self.draw_eval_bar())
         self.canvas = tk.Canvas(self, width=600, height=600, bg="white")
         self.canvas.pack(fill="both", expand=True)
+        self.canvas.bind("<Configure>", self.on_resize)
+        self.pending_resize = None
         self.selected_piece = None  # Initialize selected_piece attribute
         self.create_board()  # Move the create_board() call after initializing selected_piece
         self.setup_pieces()
         self.drag_data = {"x": 0, "y": 0, "item": None}
         self.move_counter = 0  # Initialize move counter
-        self.kings_position = {'white': (7, 4), 'black': (0, 4)}  # Track kings' positions
         self.turn_label = tk.Label(self, text="White's Turn", font=('Helvetica', 14))
         self.turn_label.pack(side="bottom")
+        self.redo_moves = []  # Moves taken back with undo, most recent last
+        self.game_over = False  # Set once checkmate, stalemate or a dead draw has been announced
+        self.legal_move_cache = collections.OrderedDict()  # Zobrist hash -> legal moves, see legal_moves
+        self.bind("<Control-z>", self.undo_move)
+        self.bind("<Control-y>", self.redo_move)
+        self.bind("<Control-s>", self.save_game)
+        self.bind("<Control-o>", self.load_game)
+        self.ai_color = ai_color  # Side played by the computer, or None for two players
+        self.ai_time = ai_time  # Seconds the computer may think per move
+        self.book = open_book()  # None when there is no book.bin next to the program
+        self.tablebase = Tablebase()  # Endgame tables from tablebases/, when any have been built
+        self.searcher = Searcher(book=self.book, tablebase=self.tablebase)
+        self.ai_result = None
+        self.ai_thinking = False
+        self.hint_searcher = Searcher(table_size=1 << 16, book=self.book)
+        self.hint_pending = False
+        self.bind("<h>", self.show_hint)
+        if instrument.requested():
+            self.bind("<Control-p>", self.dump_profile)
+        self.analysis = AnalysisWorker()  # Evaluates the position on the board in another process
+        self.analysis_shown = None  # (move, score, depth) drawn on the bar and arrow
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after_idle(self.start_analysis)
+        self.after(100, self.poll_analysis)
+        self.after(10, self.wait_for_sprites)
+
+
+    def piece_image(self, piece):
+        return self.sprites.get(piece, self.square_size)
+
+    def wait_for_sprites(self):
+        # The window opens with an empty board and the pieces appear once the
+        # background decode is done, instead of the Tk thread decoding them too
+        if not self.sprites.ready(self.square_size):
+            self.after(10, self.wait_for_sprites)
+            return
+        self.sprites_ready = True
+        self.redraw_board()
 
-
-    def load_piece_images(self):
-        pieces = {}
-        for color in ['white', 'black']:
-            for piece in ['pawn', 'rook', 'knight', 'bishop', 'queen', 'king']:
-                img = Image.open(f"Pieces/{color}{piece}.png")
-                img = img.resize((75, 75), Image.LANCZOS)
-                pieces[f'{color}{piece}'] = ImageTk.PhotoImage(img)
-        return pieces
+    def on_resize(self, event):
+        # Wait for the size to settle before rescaling; see relayout_board
+        square_size = max(min(event.width, event.height) // 8, 8)
+        if self.pending_resize is not None:
+            self.after_cancel(self.pending_resize)
+            self.pending_resize = None
+        if square_size != self.square_size:
+            self.pending_resize = self.after(100, self.relayout_board, square_size)
+
+    def relayout_board(self, square_size):
+        # Decode the settled size in the background and keep showing the old
+        # images until it is done; a further resize cancels the wait
+        self.pending_resize = None
+        self.sprites.preload(square_size)
+        if not self.sprites.ready(square_size):
+            self.pending_resize = self.after(10, self.relayout_board, square_size)
+            return
+        self.square_size = square_size
+        for (i, j), item in self.square_items.items():
+            x1, y1 = j * square_size, i * square_size
+            self.canvas.coords(item, x1, y1, x1 + square_size, y1 + square_size)
+        for (i, j), item in self.piece_items.items():
+            self.canvas.coords(item, *self.square_center(i, j))
+            self.canvas.itemconfig(item, image=self.piece_image(self.drawn_pieces[(i, j)]))
+        moves, self.shown_highlights = self.shown_highlights, None
+        self.show_highlights(moves)
+        self.show_hint_arrow(self.analysis_shown[0] if self.analysis_shown else None)
 
     def create_board(self):
         self.canvas.bind("<Button-1>", self.on_square_click)
         self.canvas.bind("<B1-Motion>", self.on_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_drop)
-        self.redraw_board()
-
-    def redraw_board(self):
-        self.canvas.delete("all")  # Clear the canvas
-        square_size = 600 // 8
+        # Canvas items are created once and then updated in place: squares at
+        # the bottom, a reusable pool of highlight outlines above them, and one
+        # image item per piece on top
+        square_size = self.square_size
+        self.square_items = {}
         for i in range(8):
             for j in range(8):
                 x1, y1 = j * square_size, i * square_size
                 x2, y2 = x1 + square_size, y1 + square_size
                 color = "white" if (i+j) % 2 == 0 else "gray"
-                self.canvas.create_rectangle(x1, y1, x2, y2, fill=color, tags="square")
-        
+                self.square_items[(i, j)] = self.canvas.create_rectangle(x1, y1, x2, y2, fill=color, tags="square")
+        # A single piece never has more than 27 destinations
+        self.highlight_items = [self.canvas.create_rectangle(0, 0, 0, 0, outline="green", width=3,
+                                                             state="hidden", tags="highlight")
+                                for _ in range(27)]
+        self.shown_highlights = []
+        self.highlighted_moves = []  # Legal moves of the selected piece, worked out once on selection
+        self.piece_items = {}  # (row, col) -> canvas image item
+        self.drawn_pieces = {}  # (row, col) -> piece identifier currently shown there
+        self.hint_arrow = self.canvas.create_line(0, 0, 0, 0, arrow=tk.LAST, fill="#1e90ff",
+                                                  state="hidden", tags="hint")
+        self.redraw_board()
+
+    def redraw_board(self):
+        # Bring the canvas in line with the position, touching only the
+        # squares whose piece changed since the last call
+        if not self.sprites_ready:
+            return  # wait_for_sprites draws the board once the images are decoded
+        board = self.position.board
+        for i in range(8):
+            for j in range(8):
+                piece = board[i][j]
+                if self.drawn_pieces.get((i, j), '') == piece:
+                    continue
+                item = self.piece_items.get((i, j))
+                if not piece:
+                    self.canvas.delete(item)
+                    del self.piece_items[(i, j)]
+                elif item is None:
+                    self.place_piece(i, j, piece)
+                else:
+                    self.canvas.itemconfig(item, image=self.piece_image(piece))
+                    self.canvas.coords(item, *self.square_center(i, j))
+                self.drawn_pieces[(i, j)] = piece
+
         # Highlight squares if a piece is selected
-        if self.selected_piece:
-            start_row = self.drag_data["start_row"]
-            start_col = self.drag_data["start_col"]
-            piece_identifier = self.board[start_row][start_col]
-            legal_moves = self.calculate_legal_moves(piece_identifier, start_row, start_col)
-            for move in legal_moves:
-                row, col = move
+        self.show_highlights(self.highlighted_moves if self.selected_piece else [])
+
+    def show_highlights(self, moves):
+        if moves == self.shown_highlights:
+            return
+        square_size = self.square_size
+        for index, item in enumerate(self.highlight_items):
+            if index < len(moves):
+                row, col = moves[index]
                 x1, y1 = col * square_size, row * square_size
-                x2, y2 = x1 + square_size, y1 + square_size
-                self.canvas.create_rectangle(x1, y1, x2, y2, outline="green", width=3, tags="highlight")
-        
-        # Place pieces on the board
-        for i, row in enumerate(self.board):
-            for j, piece in enumerate(row):
-                if piece:
-                    self.place_piece(i, j, piece)
+                self.canvas.coords(item, x1, y1, x1 + square_size, y1 + square_size)
+                self.canvas.itemconfig(item, state="normal")
+            elif self.shown_highlights is None or index < len(self.shown_highlights):
+                self.canvas.itemconfig(item, state="hidden")
+        self.shown_highlights = list(moves)
 
 
     def setup_pieces(self):
-        piece_order = ['rook', 'knight', 'bishop', 'queen', 'king', 'bishop', 'knight', 'rook']
-        for i in range(8):
-            self.board[0][i] = f'black{piece_order[i]}'
-            self.board[1][i] = 'blackpawn'
-            self.board[6][i] = 'whitepawn'
-            self.board[7][i] = f'white{piece_order[i]}'
+        self.position.setup_pieces()
         self.redraw_board()
 
+    def square_center(self, row, col):
+        return col * self.square_size + self.square_size // 2, row * self.square_size + self.square_size // 2
+
     def place_piece(self, row, col, piece):
-        x = col * (600 // 8) + (600 // 8) // 2
-        y = row * (600 // 8) + (600 // 8) // 2
-        self.canvas.create_image(x, y, anchor='center', image=self.piece_images[piece], tags="piece")
+        x, y = self.square_center(row, col)
+        item = self.canvas.create_image(x, y, anchor='center', image=self.piece_image(piece), tags="piece")
+        self.piece_items[(row, col)] = item
+        return item
 
 
     def switch_turn(self):
@@ -104,206 +227,281 @@ class ChessGame(tk.Tk):
             self.turn_label.config(text="White's Turn")
         else:
             self.turn_label.config(text="Black's Turn")
-    
-    def update_kings_position(self):
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece.endswith('king'):
-                    self.kings_position[piece[:5]] = (row, col)
-    def is_king_in_check(self, king_color):
-        enemy_color = 'black' if king_color == 'white' else 'white'
-        king_pos = self.kings_position[king_color]
-
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece.startswith(enemy_color):
-                    if self.is_legal_move(piece, row, col, king_pos[0], king_pos[1], checking_check=True):
-                        return True
-        return False
-
-    def calculate_legal_moves(self, piece_identifier, start_row, start_col):
-        legal_moves = []
-        for row in range(8):
-            for col in range(8):
-                if self.is_legal_move(piece_identifier, start_row, start_col, row, col):
-                    legal_moves.append((row, col))
-        return legal_moves
-    
-    def highlight_legal_moves(self, piece_identifier, start_row, start_col):
-        self.redraw_board()  # Clear previous highlights
-        legal_moves = self.calculate_legal_moves(piece_identifier, start_row, start_col)
-        for move in legal_moves:
-            row, col = move
-            x1, y1 = col * (600 // 8), row * (600 // 8)
-            x2, y2 = x1 + (600 // 8), y1 + (600 // 8)
-            self.canvas.create_rectangle(x1, y1, x2, y2, outline="green", width=3, tags="highlight")
-
-    def is_king_in_check_after_move(self, start_row, start_col, dest_row, dest_col):
-        piece = self.board[start_row][start_col]
-        moved_piece = self.board[dest_row][dest_col]
-        self.board[dest_row][dest_col] = piece
-        self.board[start_row][start_col] = ''
-        king_color = 'white' if piece.startswith('white') else 'black'
-        king_pos = self.kings_position[king_color]
-        in_check = self.is_king_in_check(king_color)
-        # Restore the board state
-        self.board[start_row][start_col] = piece
-        self.board[dest_row][dest_col] = moved_piece
-        return in_check
-
-    def find_blocking_pieces(self, king_color):
-        blocking_pieces = []
-        king_pos = self.kings_position[king_color]
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece and piece.startswith(king_color):
-                    legal_moves = self.calculate_legal_moves(piece, row, col)
-                    for move in legal_moves:
-                        dest_row, dest_col = move
-                        if (dest_row, dest_col) == king_pos:
-                            blocking_pieces.append(piece)
-        return blocking_pieces
-
-    def find_threatening_piece(self, king_color):
-        king_pos = self.kings_position[king_color]
-        enemy_color = 'white' if king_color == 'black' else 'black'
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece and piece.startswith(enemy_color):
-                    if self.is_legal_move(piece, row, col, king_pos[0], king_pos[1]):
-                        return (row, col)
-        return None
 
+    def legal_moves(self):
+        # Fully legal moves of the current position as {(row, col): [(row, col), ...]}.
+        # Generated once per position and kept by its hash, so clicks,
+        # highlighting, drops and the end-of-game check all share one list
+        key = self.position.zobrist
+        moves = self.legal_move_cache.get(key)
+        if moves is not None:
+            self.legal_move_cache.move_to_end(key)
+            return moves
+        moves = {}
+        for start, dest, promotion in self.position.legal_moves():
+            if promotion in ('', 'queen'):  # One entry per promotion square
+                moves.setdefault(divmod(start, 8), []).append(divmod(dest, 8))
+        self.legal_move_cache[key] = moves
+        if len(self.legal_move_cache) > LEGAL_MOVE_CACHE_SIZE:
+            self.legal_move_cache.popitem(last=False)
+        return moves
 
+    def highlight_legal_moves(self, piece_identifier, start_row, start_col):
+        self.highlighted_moves = self.legal_moves().get((start_row, start_col), [])
+        self.show_highlights(self.highlighted_moves)
 
-        
     def on_square_click(self, event):
-        col = event.x // (600 // 8)
-        row = event.y // (600 // 8)
+        col = event.x // self.square_size
+        row = event.y // self.square_size
         if 0 <= row < 8 and 0 <= col < 8:
-            piece = self.board[row][col]
-            if (self.move_counter % 2 == 0 and piece and piece.startswith('white')) or \
-               (self.move_counter % 2 != 0 and piece and piece.startswith('black')):
-                self.selected_piece = self.canvas.find_closest(event.x, event.y)[0]
+            piece = self.position.piece_at(row, col)
+            if self.game_over:
+                return
+            if not self.sprites_ready:
+                return  # Nothing to pick up until the pieces are drawn
+            if self.ai_thinking or self.position.turn == self.ai_color:
+                return  # Wait for the computer to move
+            if piece and piece.startswith(self.position.turn):
+                # Pieces with no legal moves (pinned, or unable to answer a check) can't be picked up
+                self.highlight_legal_moves(piece, row, col)
+                if not self.highlighted_moves:
+                    self.selected_piece = None
+                    return
+                self.selected_piece = self.piece_items[(row, col)]
+                self.canvas.tag_raise(self.selected_piece)  # Drag above the other pieces
                 self.drag_data["x"] = event.x
                 self.drag_data["y"] = event.y
                 self.drag_data["start_col"] = col
                 self.drag_data["start_row"] = row
-                self.drag_data["x_offset"] = event.x - (col * (600 // 8) + (600 // 8) // 2)
-                self.drag_data["y_offset"] = event.y - (row * (600 // 8) + (600 // 8) // 2)
-                # Check if the selected piece can block or move the king out of check
-                king_color = 'white' if self.move_counter % 2 == 0 else 'black'
-                if self.is_king_in_check(king_color):
-                    if piece.endswith('king'):
-                        # If the selected piece is the king, it must move to a safe square
-                        legal_moves = self.calculate_legal_moves(piece, row, col)
-                        safe_moves = []
-                        for move in legal_moves:
-                            dest_row, dest_col = move
-                            if not self.is_king_in_check_after_move(row, col, dest_row, dest_col):
-                                safe_moves.append(move)
-                        if safe_moves:
-                            self.highlight_legal_moves(piece, row, col)
-                        else:
-                            # No safe moves for the king, so ignore the click
-                            self.selected_piece = None
-                    else:
-                        # If the selected piece is not the king, it must block the check or capture the threatening piece
-                        blocking_pieces = self.find_blocking_pieces(king_color)
-                        if blocking_pieces:
-                            # Only allow selecting pieces that can block the check
-                            if piece in blocking_pieces:
-                                self.highlight_legal_moves(piece, row, col)
-                            else:
-                                # Ignore the click if the selected piece cannot block the check
-                                self.selected_piece = None
-                        else:
-                            # No blocking pieces available, so only allow capturing the threatening piece
-                            threatening_piece_pos = self.find_threatening_piece(king_color)
-                            if threatening_piece_pos:
-                                threatening_piece_row, threatening_piece_col = threatening_piece_pos
-                                threatening_piece = self.board[threatening_piece_row][threatening_piece_col]
-                                if piece.endswith('pawn') or self.is_legal_move(piece, row, col, threatening_piece_row, threatening_piece_col):
-                                    self.highlight_legal_moves(piece, row, col)
-                                else:
-                                    # Ignore the click if the selected piece cannot capture the threatening piece
-                                    self.selected_piece = None
-                            else:
-                                # No threatening piece found (shouldn't happen), so ignore the click
-                                self.selected_piece = None
-                else:
-                    # King is not in check, highlight legal moves as usual
-                    self.highlight_legal_moves(piece, row, col)
-
-
-
-        
-
-    def is_castling_move(self, piece_type, start_row, start_col, dest_row, dest_col):
-        print(self, piece_type, start_row, start_col, dest_row, dest_col)
-        if piece_type == 'king':
-            # Check if the king is at its initial position and moving two squares left or right
-            if start_row == dest_row and abs(dest_col - start_col) == 2 and \
-                    ((start_row == 0 and start_col == 4 and dest_col == 2) or  # Queen side castling for black
-                     (start_row == 7 and start_col == 4 and dest_col == 2) or  # Queen side castling for white
-                     (start_row == 0 and start_col == 4 and dest_col == 6) or  # King side castling for black
-                     (start_row == 7 and start_col == 4 and dest_col == 6)):   # King side castling for white
-
-                # Check if the squares the king moves through are not under attack
-                if not self.is_king_in_check('white' if self.move_counter % 2 == 0 else 'black'):
-                    enemy_color = 'black' if self.move_counter % 2 == 0 else 'white'
-                    if not self.is_square_attacked(start_row, start_col, enemy_color) and \
-                       not self.is_square_attacked(start_row, (start_col + dest_col) // 2, enemy_color) and \
-                       not self.is_square_attacked(start_row, dest_col, enemy_color):
-                        print("Castling move detected")
-                        return True
-        return False
-
-
-    def is_square_attacked(self, row, col, attacker_color):
-        for i in range(8):
-            for j in range(8):
-                piece = self.board[i][j]
-                if piece and piece.startswith(attacker_color):
-                    if self.is_legal_move(piece, i, j, row, col, checking_check=True):
-                        return True
-        return False
-
-    def perform_castling(self, king_piece, start_row, start_col, dest_row, dest_col):
+                self.drag_data["x_offset"] = event.x - (col * self.square_size + self.square_size // 2)
+                self.drag_data["y_offset"] = event.y - (row * self.square_size + self.square_size // 2)
+
+    def undo_move(self, event=None):
+        if self.position.move_history and not self.ai_thinking:
+            self.redo_moves.append(self.position.unmake_move())
+            self.move_counter -= 1
+            # Against the computer, take back its reply as well as our move
+            if self.position.turn == self.ai_color and self.position.move_history:
+                self.redo_moves.append(self.position.unmake_move())
+                self.move_counter -= 1
+            self.selected_piece = None
+            self.game_over = self.game_end() is not None
+            self.switch_turn()
+            self.redraw_board()
+            self.start_analysis()
+
+    def redo_move(self, event=None):
+        if self.redo_moves and not self.ai_thinking:
+            self.position.make_move(self.redo_moves.pop())
+            self.move_counter += 1
+            if self.position.turn == self.ai_color and self.redo_moves:
+                self.position.make_move(self.redo_moves.pop())
+                self.move_counter += 1
+            self.selected_piece = None
+            self.game_over = self.game_end() is not None
+            self.switch_turn()
+            self.redraw_board()
+            self.start_analysis()
+
+    def save_game(self, event=None):
+        path = filedialog.asksaveasfilename(
+            parent=self, defaultextension=".pgn",
+            filetypes=[("PGN game", "*.pgn"), ("FEN position", "*.fen")])
+        if not path:
+            return
+        if path.lower().endswith(".fen"):
+            text = self.position.fen() + "\n"
+        else:
+            text = export_pgn(self.position, {"Event": "ChessGame"})
+        try:
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(text)
+        except OSError as error:
+            log.warning("event=save_failed path=%s error=%s", path, error)
+            messagebox.showerror("Save Game", f"Could not save the game: {error}")
+
+    def load_game(self, event=None):
+        # A .fen file sets up a position; anything else is read as PGN and
+        # its first game is replayed so undo works through its moves
+        if self.ai_thinking:
+            return
+        path = filedialog.askopenfilename(
+            parent=self, filetypes=[("PGN game", "*.pgn"), ("FEN position", "*.fen"), ("All files", "*")])
+        if not path:
+            return
         try:
-            # Move the king
-            self.board[start_row][start_col] = ''  # Clear the king's original position
-            self.board[dest_row][dest_col] = king_piece  # Move the king to the destination position
-            king_x = dest_col * (600 // 8) + (600 // 8) // 2
-            king_y = dest_row * (600 // 8) + (600 // 8) // 2
-            self.canvas.coords(king_piece, king_x, king_y)  # Update king's position on the canvas
-
-            # Move the corresponding rook
-            if dest_col == 6:  # Kingside castling
-                rook_piece = self.board[dest_row][7]  # Get the rook piece
-                self.board[dest_row][7] = ''  # Clear the rook's original position
-                self.board[dest_row][5] = rook_piece  # Move the rook to the destination position
-                rook_x = 5 * (600 // 8) + (600 // 8) // 2
-                rook_y = dest_row * (600 // 8) + (600 // 8) // 2
-                rook_piece_id = self.canvas.find_withtag(rook_piece)[0]
-                self.canvas.coords(rook_piece_id, rook_x, rook_y)  # Update rook's position on the canvas
-            elif dest_col == 2:  # Queenside castling
-                rook_piece = self.board[dest_row][0]  # Get the rook piece
-                self.board[dest_row][0] = ''  # Clear the rook's original position
-                self.board[dest_row][3] = rook_piece  # Move the rook to the destination position
-                rook_x = 3 * (600 // 8) + (600 // 8) // 2
-                rook_y = dest_row * (600 // 8) + (600 // 8) // 2
-                rook_piece_id = self.canvas.find_withtag(rook_piece)[0]
-                self.canvas.coords(rook_piece_id, rook_x, rook_y)  # Update rook's position on the canvas
-
-        except IndexError:
-            print("Error: King or rook piece ID not found on canvas.")
-            # Handle the error here, such as displaying an error message or logging it.
+            if path.lower().endswith(".fen"):
+                with open(path, encoding="utf-8") as file:
+                    position = Position.from_fen(file.readline().strip())
+            else:
+                with open_pgn(path) as lines:
+                    game = next(read_games(lines), None)
+                if game is None:
+                    raise PGNError("The file has no games in it")
+                position = start_position(game)
+                for _ in replay(game, position):
+                    pass
+        except (OSError, ValueError) as error:
+            log.warning("event=load_failed path=%s error=%s", path, error)
+            messagebox.showerror("Load Game", f"Could not load the game: {error}")
+            return
+        self.position = position
+        self.move_counter = 0 if position.turn == 'white' else 1  # Only the parity is shown
+        self.redo_moves = []
+        self.selected_piece = None
+        self.switch_turn()
+        self.redraw_board()
+        self.after_move()
+
+    def dump_profile(self, event=None):
+        path = filedialog.asksaveasfilename(parent=self, defaultextension=".json",
+                                            initialfile="chess-profile.json",
+                                            filetypes=[("JSON", "*.json")])
+        if path:
+            instrument.dump(path)
+
+    def start_ai_move(self):
+        # Search on a worker thread and poll for the answer with after(), so
+        # dragging and redrawing carry on while the computer thinks
+        self.ai_thinking = True
+        self.ai_result = None
+        position = self.position.copy()
+
+        def think():
+            self.ai_result = self.searcher.search(position, time_limit=self.ai_time)
+
+        threading.Thread(target=think, daemon=True).start()
+        self.after(50, self.poll_ai_move)
+
+    def poll_ai_move(self):
+        if self.ai_result is None:
+            self.after(50, self.poll_ai_move)
+            return
+        result = self.ai_result
+        self.ai_result = None
+        self.ai_thinking = False
+        if result.move is not None:
+            self.position.make_move(result.move)
+            self.move_counter += 1
+            self.redo_moves = []
+            log.debug("event=ai_move move=%s score=%d depth=%d nodes=%d seconds=%.3f",
+                      move_to_uci(result.move), result.score, result.depth, result.nodes, result.elapsed)
+        self.switch_turn()
+        self.redraw_board()
+        self.after_move()
+
+    def show_hint(self, event=None):
+        # Highlight the from and to squares of a suggested move: the book move
+        # when there is one, otherwise the result of a short search
+        if self.ai_thinking or self.hint_pending or self.position.turn == self.ai_color:
+            return
+        self.hint_pending = True
+        position = self.position.copy()
+        result = {}
+
+        def think():
+            result['move'] = self.hint_searcher.search(position, time_limit=0.5).move
+
+        threading.Thread(target=think, daemon=True).start()
+        self.after(50, self.poll_hint, result, position.zobrist)
+
+    def poll_hint(self, result, key):
+        if 'move' not in result:
+            self.after(50, self.poll_hint, result, key)
+            return
+        self.hint_pending = False
+        move = result['move']
+        if move is not None and key == self.position.zobrist and not self.selected_piece:
+            self.show_highlights([divmod(move[0], 8), divmod(move[1], 8)])
+
+    def start_analysis(self):
+        # Drop the analysis of the previous position and start on this one.
+        # While the computer is thinking the analysis waits, so the two
+        # searches don't compete for the CPU
+        self.analysis_shown = None
+        self.show_hint_arrow(None)
+        if self.position.turn == self.ai_color or not self.legal_moves():
+            self.analysis.cancel()
+        else:
+            self.analysis.analyse(self.position)
+
+    def poll_analysis(self):
+        result = self.analysis.poll()
+        if result is not None and result != self.analysis_shown:
+            self.analysis_shown = result
+            move, score, depth = result
+            self.show_hint_arrow(move)
+            self.show_evaluation(score if self.position.turn == 'white' else -score)
+        self.after(100, self.poll_analysis)
+
+    def show_hint_arrow(self, move):
+        if move is None:
+            self.canvas.itemconfig(self.hint_arrow, state="hidden")
+            return
+        (start_row, start_col), (dest_row, dest_col) = divmod(move[0], 8), divmod(move[1], 8)
+        self.canvas.coords(self.hint_arrow, *self.square_center(start_row, start_col),
+                           *self.square_center(dest_row, dest_col))
+        self.canvas.itemconfig(self.hint_arrow, state="normal", width=max(self.square_size // 10, 2),
+                               arrowshape=(self.square_size // 3, self.square_size // 3, self.square_size // 8))
+        self.canvas.tag_raise(self.hint_arrow)
+
+    def show_evaluation(self, white_score):
+        if abs(white_score) >= MATE_SCORE - MAX_PLY:
+            moves = (MATE_SCORE - abs(white_score) + 1) // 2
+            text = f"M{moves}" if white_score > 0 else f"-M{moves}"
+            self.eval_fraction = 1.0 if white_score > 0 else 0.0
+        else:
+            text = f"{white_score / 100:+.1f}"
+            # Centipawns to an expected score, as rating systems do
+            self.eval_fraction = 1 / (1 + 10 ** (-white_score / 400))
+        self.eval_bar.itemconfig(self.eval_text, text=text)
+        self.draw_eval_bar()
+
+    def draw_eval_bar(self):
+        width, height = self.eval_bar.winfo_width(), self.eval_bar.winfo_height()
+        self.eval_bar.coords(self.eval_fill, 0, height * (1 - self.eval_fraction), width, height)
+        self.eval_bar.coords(self.eval_text, width // 2, height // 2)
+        self.eval_bar.tag_raise(self.eval_text)
+
+    def on_close(self):
+        self.analysis.close()
+        self.destroy()
+
+    def game_end(self):
+        # (title, message) when the game on the board is over, otherwise None
+        king_color = self.position.turn
+        if not self.legal_moves():  # Also fills the cache for this turn's clicks
+            if self.position.is_king_in_check(king_color):
+                return "Checkmate", f"Checkmate! {opponent(king_color).capitalize()} wins."
+            return "Stalemate", "Stalemate! The game is a draw."
+        if self.tablebase.is_dead_draw(self.position):
+            return "Draw", "Neither side can checkmate. The game is a draw."
+        return None
 
+    def after_move(self):
+        self.start_analysis()
+        king_color = self.position.turn
+        in_check = self.position.is_king_in_check(king_color)
+        end = self.game_end()
+        self.game_over = end is not None
+        if end is not None:
+            # Announced once; on_square_click ignores the board until an undo or load
+            messagebox.showinfo(*end)
+            return
+        verdict = self.tablebase.probe(self.position)
+        if verdict is not None:
+            # Known endgame: show the result with best play next to the turn
+            if verdict.wdl:
+                winner = king_color if verdict.wdl > 0 else opponent(king_color)
+                outlook = f"{winner.capitalize()} mates in {(verdict.dtm + 1) // 2}"
+            else:
+                outlook = "Drawn with best play"
+            self.turn_label.config(text=f"{self.turn_label.cget('text')} ({outlook})")
+        if in_check:
+            # Shown beside the turn rather than in a dialog, which would stall the window
+            self.turn_label.config(text=f"{self.turn_label.cget('text')} - {king_color.capitalize()} is in check!")
+        if king_color == self.ai_color:
+            self.start_ai_move()
 
     def on_drag(self, event):
         if self.selected_piece:
@@ -315,231 +513,37 @@ class ChessGame(tk.Tk):
 
     def on_drop(self, event):
         if self.selected_piece:
-            col = min(max(event.x // (600 // 8), 0), 7)
-            row = min(max(event.y // (600 // 8), 0), 7)
-            x = col * (600 // 8) + (600 // 8) // 2
-            y = row * (600 // 8) + (600 // 8) // 2
-
-            # If the piece is dropped back to its original position, just update the coordinates
-            if col == self.drag_data["start_col"] and row == self.drag_data["start_row"]:
-                self.canvas.coords(self.selected_piece, x, y)
-                self.board[row][col] = self.board[self.drag_data["start_row"]][self.drag_data["start_col"]]  # Update the board with the piece identifier
-            else:
-                piece_identifier = self.board[self.drag_data["start_row"]][self.drag_data["start_col"]]
-                # Check if the move is legal
-                if self.is_legal_move(piece_identifier, self.drag_data["start_row"], self.drag_data["start_col"], row, col):
-                    # Snap the piece to the nearest square
-                    self.canvas.coords(self.selected_piece, x, y)
-                    self.board[self.drag_data["start_row"]][self.drag_data["start_col"]] = ''  # Clear the previous position
-
-                    # If the destination square is not empty, remove the captured piece from the canvas
-                    if self.board[row][col]:
-                        captured_piece = self.board[row][col]
-                        self.canvas.delete(captured_piece)
-                    self.board[row][col] = piece_identifier  # Update the board with the piece identifier
-                    self.move_counter += 1  # Increment move counter after each move
-
-                # Check for castling move
-                elif piece_identifier.endswith('king') and abs(self.drag_data["start_col"] - col) == 2:
-                    print("Castling move detected!")
-                    print("King start position:", self.drag_data["start_row"], self.drag_data["start_col"])
-                    print("King end position:", row, col)
-                    print("Rook start position:", row, 7 if col == 2 else 0)
-                    print("Rook end position:", row, 5 if col == 2 else 3)
-                    self.perform_castling(self.board[self.drag_data["start_row"]][self.drag_data["start_col"]], self.drag_data["start_row"], self.drag_data["start_col"], row, col)
-
-                # Check for en passant
-                elif piece_identifier.startswith('whitepawn') or piece_identifier.startswith('blackpawn'):
-                    if abs(row - self.drag_data["start_row"]) == 2:
-                        self.en_passant_square = (row, col)
-                    elif col != self.drag_data["start_col"] and self.board[row][col] == '':
-                        en_passant_row = row - 1 if piece_identifier.startswith('whitepawn') else row + 1
-                        en_passant_col = col
-                        if (en_passant_row, en_passant_col) == self.en_passant_square:
-                            captured_pawn_row = self.drag_data["start_row"]
-                            captured_pawn_col = col
-                            captured_pawn = self.board[captured_pawn_row][captured_pawn_col]
-                            self.board[captured_pawn_row][captured_pawn_col] = ''  # Remove the captured pawn from the board
-                            self.canvas.delete(captured_pawn)  # Remove the captured pawn from the canvas
-                            
-                else:
-                    # Move is not legal, ignore the drop action and revert the piece to its original position
-                    self.canvas.coords(self.selected_piece, self.drag_data["x"], self.drag_data["y"])
+            col = min(max(event.x // self.square_size, 0), 7)
+            row = min(max(event.y // self.square_size, 0), 7)
+            start_row = self.drag_data["start_row"]
+            start_col = self.drag_data["start_col"]
 
+            # The rules engine takes care of captures, castling, en passant and promotion;
+            # snap the piece back first so an illegal drop leaves it where it started
+            self.canvas.coords(self.selected_piece, *self.square_center(start_row, start_col))
+            moved = (row, col) in self.legal_moves().get((start_row, start_col), [])
+            if moved:
+                self.position.apply_move(start_row, start_col, row, col)
+                self.move_counter += 1  # Increment move counter after each move
+                self.redo_moves = []
+                log.debug("event=move move=%s fen=%s", move_to_uci(self.position.move_history[-1]),
+                          self.position.fen())
+            else:
+                log.debug("event=illegal_drop from=%d,%d to=%d,%d", start_row, start_col, row, col)
 
             self.selected_piece = None
-            self.update_kings_position()
             self.switch_turn()
             self.redraw_board()
 
-            # After move logic
-            if self.is_king_in_check('white'):
-                messagebox.showinfo("Check", "White king is in check!")
-            elif self.is_king_in_check('black'):
-                messagebox.showinfo("Check", "Black king is in check!")
-
-
-    def is_legal_move(self, piece_identifier, start_row, start_col, dest_row, dest_col, checking_check=False):
-        piece_type = piece_identifier[5:]  # Extracting the type of piece from the identifier
-        color = piece_identifier[:5]  # Extracting the color of the piece from the identifier
-        
-        if piece_type == 'pawn':
-            # Pawn moves
-            if color == 'white':
-                if start_col == dest_col and start_row - dest_row == 1:
-                    return True  # Normal move forward
-                elif start_row == 6 and start_col == dest_col and start_row - dest_row == 2:
-                    return True  # Initial double move forward
-                elif abs(start_col - dest_col) == 1 and start_row - dest_row == 1:
-                    # Capture move diagonally
-                    if self.board[dest_row][dest_col].startswith('black'):
-                        return True
-            elif color == 'black':
-                if start_col == dest_col and dest_row - start_row == 1:
-                    return True  # Normal move forward
-                elif start_row == 1 and start_col == dest_col and dest_row - start_row == 2:
-                    return True  # Initial double move forward
-                elif abs(start_col - dest_col) == 1 and dest_row - start_row == 1:
-                    # Capture move diagonally
-                    if self.board[dest_row][dest_col].startswith('white'):
-                        return True
-
-                    
-        elif piece_type == 'rook':
-            # Rook moves (straight lines)
-            if start_row == dest_row:
-                # Horizontal move
-                if start_col < dest_col:
-                    for col in range(start_col + 1, dest_col):
-                        if self.board[start_row][col]:
-                            return False  # Path obstructed
-                    if self.board[dest_row][dest_col] == '' or \
-                       (color == 'white' and self.board[dest_row][dest_col].startswith('black')) or \
-                       (color == 'black' and self.board[dest_row][dest_col].startswith('white')):
-                        return True
-                elif start_col > dest_col:
-                    for col in range(dest_col + 1, start_col):
-                        if self.board[start_row][col]:
-                            return False  # Path obstructed
-                    if self.board[dest_row][dest_col] == '' or \
-                       (color == 'white' and self.board[dest_row][dest_col].startswith('black')) or \
-                       (color == 'black' and self.board[dest_row][dest_col].startswith('white')):
-                        return True
-            elif start_col == dest_col:
-                # Vertical move
-                if start_row < dest_row:
-                    for row in range(start_row + 1, dest_row):
-                        if self.board[row][start_col]:
-                            return False  # Path obstructed
-                    if self.board[dest_row][dest_col] == '' or \
-                       (color == 'white' and self.board[dest_row][dest_col].startswith('black')) or \
-                       (color == 'black' and self.board[dest_row][dest_col].startswith('white')):
-                        return True
-                elif start_row > dest_row:
-                    for row in range(dest_row + 1, start_row):
-                        if self.board[row][start_col]:
-                            return False  # Path obstructed
-                    if self.board[dest_row][dest_col] == '' or \
-                       (color == 'white' and self.board[dest_row][dest_col].startswith('black')) or \
-                       (color == 'black' and self.board[dest_row][dest_col].startswith('white')):
-                        return True
-
-
-        elif piece_type == 'knight':
-            # Knight moves (L-shape)
-            if (abs(dest_row - start_row) == 2 and abs(dest_col - start_col) == 1) or \
-               (abs(dest_row - start_row) == 1 and abs(dest_col - start_col) == 2):
-                if self.board[dest_row][dest_col] == '' or \
-                   (color == 'white' and self.board[dest_row][dest_col].startswith('black')) or \
-                   (color == 'black' and self.board[dest_row][dest_col].startswith('white')):
-                    return True
-                
-
-        elif piece_type == 'bishop':
-            # Bishop moves (diagonals)
-            if abs(dest_row - start_row) == abs(dest_col - start_col):
-                # Diagonal move
-                if dest_row > start_row:
-                    row_direction = 1
-                else:
-                    row_direction = -1
-                if dest_col > start_col:
-                    col_direction = 1
-                else:
-                    col_direction = -1
-
-                row, col = start_row + row_direction, start_col + col_direction
-                while row != dest_row and col != dest_col:
-                    if self.board[row][col]:
-                        return False  # Path obstructed
-                    row += row_direction
-                    col += col_direction
-                if self.board[dest_row][dest_col] == '' or \
-                   (color == 'white' and self.board[dest_row][dest_col].startswith('black')) or \
-                   (color == 'black' and self.board[dest_row][dest_col].startswith('white')):
-                    return True
-
-
-            
-        elif piece_type == 'queen':
-            # Check if the move is either perfectly vertical, horizontal, or diagonal
-            if start_row == dest_row or start_col == dest_col or abs(dest_row - start_row) == abs(dest_col - start_col):
-                # If moving horizontally or vertically
-                if start_row == dest_row or start_col == dest_col:
-                    step_row = 0 if start_row == dest_row else (1 if dest_row > start_row else -1)
-                    step_col = 0 if start_col == dest_col else (1 if dest_col > start_col else -1)
-
-                    current_row = start_row + step_row
-                    current_col = start_col + step_col
-
-                    # Check each square along the way for obstacles
-                    while current_row != dest_row or current_col != dest_col:
-                        if self.board[current_row][current_col] != '':
-                            return False  # Path is obstructed
-                        current_row += step_row
-                        current_col += step_col
-
-                # If moving diagonally
-                else:
-                    row_direction = 1 if dest_row > start_row else -1
-                    col_direction = 1 if dest_col > start_col else -1
-
-                    current_row = start_row + row_direction
-                    current_col = start_col + col_direction
-
-                    # Check each square along the way for obstacles
-                    while current_row != dest_row or current_col != dest_col:
-                        if self.board[current_row][current_col] != '':
-                            return False  # Path is obstructed
-                        current_row += row_direction
-                        current_col += col_direction
-
-                # Check the destination square
-                if self.board[dest_row][dest_col] == '' or \
-                   (color == 'white' and self.board[dest_row][dest_col][0] == 'b') or \
-                   (color == 'black' and self.board[dest_row][dest_col][0] == 'w'):
-                    return True  # The path is clear
-                else:
-                    return False  # Path is blocked by a friendly piece
-            else:
-                return False  # Not a valid queen move
-
-
-
-
-        elif piece_type == 'king':
-            # King moves
-            if abs(dest_row - start_row) <= 1 and abs(dest_col - start_col) <= 1:
-                if self.board[dest_row][dest_col] == '' or \
-                   (color == 'white' and self.board[dest_row][dest_col].startswith('black')) or \
-                   (color == 'black' and self.board[dest_row][dest_col].startswith('white')):
-                    return True
-            return False  # Invalid move for the given piece type
+            # A plain click or an illegal drop leaves the position, and its analysis, alone
+            if moved:
+                self.after_move()
 
 
 
 
 
 if __name__ == "__main__":
-    app = ChessGame() # change to MainMenu() when done coding
+    instrument.enable_from_environment(ChessGame)
+    app = MainMenu()
     app.mainloop()
@@ -0,0 +1,153 @@
+"""Opt-in call counting and timing for the rules engine and the game window.
+
+Nothing here touches the hot paths until install() is called.  install()
+swaps the named methods for wrappers that count calls and add up time, and
+uninstall() puts the originals back.  With profiling off there is no
+overhead at all.  Times are inclusive: a call's time also covers whatever
+it calls.
+
+Some methods also feed a latency histogram.  Every redraw_board is a
+"frame" and every dropped piece is a "move"; a dialog shown during the move
+counts towards it.
+
+Run the game with CHESS_PROFILE=1 to switch it on.  This also turns on the
+debug log of the 'chessgame' logger.  Set CHESS_PROFILE_FILE to a path to
+have the figures written there as JSON on exit.  Ctrl+P writes them while
+the game is running.
+"""
+
+import atexit
+import bisect
+import functools
+import json
+import logging
+import os
+import time
+
+log = logging.getLogger('chessgame')
+
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.seconds = {}
+        self.histograms = {}  # name -> counts per HISTOGRAM_BOUNDS_MS bucket, plus one for slower
+
+    def record(self, name, elapsed, histogram=None):
+        # Counts can be a little low when the search thread and the Tk thread
+        # record at once; no lock, to keep the wrapper cheap
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+        if histogram is not None:
+            counts = self.histograms.get(histogram)
+            if counts is None:
+                counts = self.histograms[histogram] = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+            counts[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, elapsed * 1000)] += 1
+
+    def snapshot(self):
+        labels = [f"<={bound}ms" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}ms"]
+        return {
+            'calls': {name: {'count': count, 'seconds': self.seconds[name]}
+                      for name, count in sorted(self.calls.items())},
+            'histograms': {name: dict(zip(labels, counts)) for name, counts in sorted(self.histograms.items())},
+        }
+
+    def report(self):
+        lines = [f"{'name':32} {'calls':>10} {'total s':>10} {'mean us':>10}"]
+        for name in sorted(self.calls, key=lambda name: -self.seconds[name]):
+            count, seconds = self.calls[name], self.seconds[name]
+            lines.append(f"{name:32} {count:10} {seconds:10.3f} {seconds / count * 1e6:10.1f}")
+        for name, counts in sorted(self.histograms.items()):
+            buckets = ' '.join(f"{bound}ms:{count}" for bound, count in zip(HISTOGRAM_BOUNDS_MS + ('inf',), counts)
+                               if count)
+            lines.append(f"{name} latency {buckets}")
+        return '\n'.join(lines)
+
+
+stats = Stats()
+_installed = []  # (owner, attribute, original) in installation order
+
+
+def timed(function, name, histogram=None):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stats.record(name, time.perf_counter() - started, histogram)
+    return wrapper
+
+
+def install(targets):
+    # targets: (class, method name, stat name, histogram name or None)
+    for owner, attribute, name, histogram in targets:
+        original = owner.__dict__[attribute]
+        setattr(owner, attribute, timed(original, name, histogram))
+        _installed.append((owner, attribute, original))
+
+
+def uninstall():
+    while _installed:
+        owner, attribute, original = _installed.pop()
+        setattr(owner, attribute, original)
+
+
+def engine_targets():
+    from ai import Searcher
+    from rules import Position
+    return [
+        (Position, '_piece_moves', 'movegen.piece_moves', None),
+        (Position, 'pseudo_legal_moves', 'movegen.pseudo_legal_moves', None),
+        (Position, 'legal_moves', 'movegen.legal_moves', None),
+        (Position, 'make_move', 'movegen.make_move', None),
+        (Position, 'unmake_move', 'movegen.unmake_move', None),
+        (Position, 'is_king_in_check', 'check.is_king_in_check', None),
+        (Position, '_is_attacked', 'check.is_attacked', None),
+        (Searcher, 'search', 'ai.search', 'search'),
+    ]
+
+
+def ui_targets(game_class):
+    # The game class is passed in because chess.py usually runs as __main__
+    return [
+        (game_class, 'redraw_board', 'render.redraw_board', 'frame'),
+        (game_class, 'place_piece', 'render.place_piece', None),
+        (game_class, 'show_highlights', 'render.show_highlights', None),
+        (game_class, 'relayout_board', 'render.relayout_board', None),
+        (game_class, 'on_square_click', 'event.click', None),
+        (game_class, 'on_drag', 'event.drag', None),
+        (game_class, 'on_drop', 'event.drop', 'move'),
+        (game_class, 'poll_ai_move', 'event.poll_ai_move', None),
+        (game_class, 'legal_moves', 'game.legal_moves', None),
+    ]
+
+
+def dump(path):
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, 'w', encoding='utf-8') as file:
+        json.dump(stats.snapshot(), file, indent=2)
+    os.replace(partial, path)
+    log.info("event=profile_dump path=%s", path)
+
+
+def requested():
+    return os.environ.get('CHESS_PROFILE', '') not in ('', '0')
+
+
+def enable_from_environment(game_class):
+    # Install everything when CHESS_PROFILE is set; returns whether it was
+    if not requested():
+        return False
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    install(engine_targets() + ui_targets(game_class))
+    path = os.environ.get('CHESS_PROFILE_FILE')
+    if path:
+        atexit.register(dump, path)
+    atexit.register(lambda: log.info("profile\n%s", stats.report()))
+    return True
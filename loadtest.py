@@ -0,0 +1,109 @@
+"""Load-test client for server.py.
+
+Opens many connections at once.  Each connection plays games against
+itself, sending random legal moves as fast as the server answers, and the
+time from sending each MOVE to reading its reply is recorded.  At the end
+the client prints the latency percentiles and the total moves per second:
+
+    python loadtest.py --clients 200 --moves 50
+    python loadtest.py --host 10.0.0.5 --port 8765 --clients 1000
+
+Without --port a server is started inside this process on a free port.
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+import server
+from rules import Position, move_to_uci
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+async def request(reader, writer, line):
+    # Send one request and return its reply, skipping the event lines
+    writer.write(line.encode() + b'\n')
+    await writer.drain()
+    while True:
+        reply = (await reader.readline()).decode()
+        if not reply:
+            raise ConnectionError("server closed the connection")
+        if reply.startswith('OK') or reply.startswith('ERR'):
+            return reply.split()
+
+
+async def run_client(host, port, moves, seed, latencies):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        played = 0
+        while played < moves:
+            game_id = (await request(reader, writer, 'NEW'))[1]
+            for color in ('white', 'black'):
+                await request(reader, writer, f'JOIN {game_id} {color}')
+            position = Position()
+            while played < moves:
+                legal = position.legal_moves()
+                if not legal or position.halfmove_clock >= 100 or position.is_threefold_repetition():
+                    break
+                move = rng.choice(legal)
+                started = time.perf_counter()
+                reply = await request(reader, writer, f'MOVE {game_id} {move_to_uci(move)}')
+                latencies.append(time.perf_counter() - started)
+                if reply[0] != 'OK':
+                    raise RuntimeError(f"server refused a legal move: {' '.join(reply)}")
+                position.make_move(move)
+                played += 1
+            if position.has_legal_moves() and position.halfmove_clock < 100 \
+                    and not position.is_threefold_repetition():
+                await request(reader, writer, f'RESIGN {game_id}')
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * percent / 100), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def load_test(host, port, clients, moves, out=sys.stdout):
+    serving = None
+    if port is None:
+        started = asyncio.get_running_loop().create_future()
+        serving = asyncio.create_task(server.serve(host, 0, started))
+        port = await started
+    latencies = []
+    began = time.perf_counter()
+    try:
+        await asyncio.gather(*(run_client(host, port, moves, seed, latencies) for seed in range(clients)))
+    finally:
+        if serving is not None:
+            serving.cancel()
+    elapsed = time.perf_counter() - began
+    latencies.sort()
+    summary = ' '.join(f"p{percent:g} {percentile(latencies, percent) * 1000:.2f}ms" for percent in PERCENTILES)
+    rate = len(latencies) / elapsed if elapsed > 0 else 0.0
+    print(f"{clients} client(s), {len(latencies)} moves in {elapsed:.2f}s ({rate:,.0f} moves/s)", file=out)
+    print(f"latency {summary} max {latencies[-1] * 1000 if latencies else 0.0:.2f}ms", file=out)
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the game server.")
+    parser.add_argument('--host', default='127.0.0.1', help="server address")
+    parser.add_argument('--port', type=int, default=None, help="server port (default: start a server in-process)")
+    parser.add_argument('--clients', type=int, default=100, help="concurrent connections")
+    parser.add_argument('--moves', type=int, default=50, help="moves each client plays")
+    args = parser.parse_args(argv)
+    asyncio.run(load_test(args.host, args.port, args.clients, args.moves))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
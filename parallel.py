@@ -0,0 +1,256 @@
+"""Multiprocess search for the computer opponent (lazy SMP).
+
+Every worker process runs an ordinary ai.Searcher on the same root position,
+each trying the root moves in a different order.  They share one
+transposition table in shared memory, so what one worker learns about a
+position cuts the others' searches short.  The answer comes from the worker
+that finished the deepest iteration.
+
+Each table slot is two 64-bit words: the position key XORed with the data
+word, and the data word itself.  A slot half-written by another process
+fails the XOR check on the next probe and reads as a miss, so no locks are
+needed.
+
+    python parallel.py --time 5 --workers 1 2 4 8
+"""
+
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+
+from ai import MAX_PLY, Searcher, SearchResult, SearchTimeout, tablebase_score
+from rules import PROMOTION_PIECES, START_FEN, Position, move_to_uci
+from tablebase import Tablebase
+
+PROMOTION_CODES = ('',) + PROMOTION_PIECES
+HEADER_WORDS = 2  # Stop flag and search generation, ahead of the slots
+MASK_64 = (1 << 64) - 1
+SCORE_OFFSET = 1 << 31
+
+
+def _encode_move(move):
+    if move is None:
+        return 0
+    start, dest, promotion = move
+    return 1 << 15 | PROMOTION_CODES.index(promotion) << 12 | dest << 6 | start
+
+
+def _decode_move(bits):
+    if not bits:
+        return None
+    return (bits & 63, bits >> 6 & 63, PROMOTION_CODES[bits >> 12 & 7])
+
+
+class SharedTranspositionTable:
+    # Same probe/store interface as transposition.TranspositionTable, storing
+    # (score, flag, move) search results in a shared memory block
+    def __init__(self, size=1 << 20, name=None):
+        slots = 1
+        while slots * 2 <= size:
+            slots *= 2
+        self.mask = slots - 1
+        nbytes = (HEADER_WORDS + 2 * slots) * 8
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.owner = True
+        else:
+            # Pool workers share the creating process's resource tracker, so
+            # only the owner's close() unlinks the block
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.words = self.memory.buf.cast('Q')
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def generation(self):
+        return self.words[1]
+
+    def new_search(self):
+        # Only the owning process starts searches, so this is the one writer
+        if self.owner:
+            self.words[1] = (self.words[1] + 1) & 63
+
+    def request_stop(self, stop=True):
+        self.words[0] = 1 if stop else 0
+
+    def stop_requested(self):
+        return self.words[0] != 0
+
+    def clear(self):
+        for index in range(HEADER_WORDS, len(self.words)):
+            self.words[index] = 0
+
+    def close(self):
+        self.words.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def probe(self, key):
+        index = HEADER_WORDS + 2 * (key & self.mask)
+        data = self.words[index + 1]
+        if data and self.words[index] ^ data == key:
+            self.hits += 1
+            score = (data & 0xFFFFFFFF) - SCORE_OFFSET
+            return data >> 32 & 0xFF, (score, data >> 40 & 3, _decode_move(data >> 42 & 0xFFFF))
+        self.misses += 1
+        return None
+
+    def get(self, key, default=None):
+        found = self.probe(key)
+        return default if found is None else found[1]
+
+    def store(self, key, value, depth=0):
+        score, flag, move = value
+        index = HEADER_WORDS + 2 * (key & self.mask)
+        old = self.words[index + 1]
+        generation = self.words[1]
+        if old and self.words[index] ^ old != key and old >> 58 == generation and depth < (old >> 32 & 0xFF):
+            return False
+        data = (score + SCORE_OFFSET
+                | min(depth, 255) << 32
+                | flag << 40
+                | _encode_move(move) << 42
+                | generation << 58)
+        self.words[index] = (key ^ data) & MASK_64
+        self.words[index + 1] = data
+        return True
+
+
+class HelperSearcher(Searcher):
+    # One worker's searcher: a rotated root move order so the workers don't
+    # all walk the same tree, and a stop flag read from shared memory
+    def __init__(self, table, helper_index, tablebase=None):
+        super().__init__(table=table, tablebase=tablebase)
+        self.helper_index = helper_index
+
+    def _root_moves(self, position):
+        moves = position.legal_moves()
+        if self.helper_index and moves:
+            shift = self.helper_index % len(moves)
+            moves = moves[shift:] + moves[:shift]
+        return moves
+
+    def _check_time(self):
+        if self.table.stop_requested():
+            raise SearchTimeout()
+        super()._check_time()
+
+
+_worker_table = None
+_worker_tablebase = None
+
+
+def _init_worker(table_name, table_size, tablebase_directory):
+    global _worker_table, _worker_tablebase
+    _worker_table = SharedTranspositionTable(table_size, name=table_name)
+    if tablebase_directory is not None:
+        # Each worker maps the same table files, so the pages are shared
+        _worker_tablebase = Tablebase(tablebase_directory)
+
+
+def _warm_up(delay):
+    # Held long enough that every submitted call needs a process of its own
+    time.sleep(delay)
+    return os.getpid()
+
+
+def _run_helper(position, helper_index, max_depth, time_limit):
+    searcher = HelperSearcher(_worker_table, helper_index, _worker_tablebase)
+    return searcher.search(position, max_depth=max_depth, time_limit=time_limit)
+
+
+class ParallelSearcher:
+    def __init__(self, workers=None, table_size=1 << 20, book=None, tablebase=None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.book = book  # Consulted in this process before any worker is started
+        self.tablebase = tablebase
+        self.table = SharedTranspositionTable(table_size)
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker,
+            initargs=(self.table.name, table_size, None if tablebase is None else tablebase.directory))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.table.close()
+
+    def warm_up(self):
+        # Start every worker process now, so their start-up and imports don't
+        # count against the first search
+        futures = [self.pool.submit(_warm_up, 0.05) for _ in range(self.workers)]
+        return len({future.result() for future in futures})
+
+    def stop(self):
+        self.table.request_stop()
+
+    def search(self, position, max_depth=MAX_PLY, time_limit=None):
+        # Returns the deepest worker's SearchResult, with nodes summed over all
+        # workers so nodes / elapsed is the combined speed
+        started = time.perf_counter()
+        if self.book is not None:
+            move = self.book.choose(position)
+            if move is not None:
+                return SearchResult(move, 0, 0, 0, time.perf_counter() - started)
+        if self.tablebase is not None:
+            found = self.tablebase.best_move(position)
+            if found is not None:
+                return SearchResult(found[0], tablebase_score(found[1], 0), 0, 0, time.perf_counter() - started)
+        self.table.request_stop(False)
+        self.table.new_search()
+        futures = [self.pool.submit(_run_helper, position, index, max_depth, time_limit)
+                   for index in range(self.workers)]
+        # Once the main worker is done the helpers' work is no longer needed
+        best = futures[0].result()
+        self.table.request_stop()
+        nodes = best.nodes
+        for future in futures[1:]:
+            result = future.result()
+            nodes += result.nodes
+            if result.depth > best.depth and result.move is not None:
+                best = result
+        return SearchResult(best.move, best.score, best.depth, nodes, time.perf_counter() - started)
+
+
+def benchmark(position, worker_counts, time_limit, out=sys.stdout):
+    # Nodes per second for each worker count, relative to the first count
+    rates = {}
+    for workers in worker_counts:
+        with ParallelSearcher(workers) as searcher:
+            searcher.warm_up()  # Keep process start-up out of the timed search
+            result = searcher.search(position, time_limit=time_limit)
+        rates[workers] = result.nodes / result.elapsed if result.elapsed > 0 else 0.0
+        scaling = rates[workers] / rates[worker_counts[0]] if rates[worker_counts[0]] else 0.0
+        move = move_to_uci(result.move) if result.move else '-'
+        print(f"{workers} worker(s): depth {result.depth} move {move} score {result.score} "
+              f"{result.nodes} nodes {rates[workers]:,.0f} nps (x{scaling:.2f})", file=out)
+    return rates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the multiprocess search.")
+    parser.add_argument('--fen', default=START_FEN, help="position to search (default: starting position)")
+    parser.add_argument('--time', type=float, default=5.0, help="seconds per search")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, multiprocessing.cpu_count()],
+                        help="worker counts to compare")
+    args = parser.parse_args(argv)
+    benchmark(Position.from_fen(args.fen), args.workers, args.time)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
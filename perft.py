@@ -0,0 +1,118 @@
+"""Perft: count the leaf nodes of the legal move tree to a fixed depth.
+
+Comparing the counts with known-good values is the standard correctness
+check for a move generator, and nodes per second makes a handy speed
+benchmark.
+
+    python perft.py --depth 4
+    python perft.py --fen "<fen>" --depth 3 --divide
+    python perft.py --suite --max-nodes 200000
+"""
+
+import argparse
+import sys
+import time
+
+from rules import START_FEN, Position, move_to_uci
+
+# Standard reference positions (from the Chess Programming Wiki) and their
+# node counts for depth 1, 2, 3, ...
+REFERENCE_POSITIONS = [
+    ('start', START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603]),
+    ('position3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238, 674624]),
+    ('position4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333]),
+    ('position5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379, 2103487]),
+    ('position6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def perft(position, depth):
+    if depth == 0:
+        return 1
+    moves = position.legal_moves()
+    if depth == 1:
+        return len(moves)  # Bulk count the last ply instead of making each move
+    nodes = 0
+    for move in moves:
+        position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move()
+    return nodes
+
+
+def divide(position, depth):
+    # Node count below each root move, for tracking down a wrong total
+    counts = {}
+    for move in position.legal_moves():
+        position.make_move(move)
+        counts[move_to_uci(move)] = perft(position, depth - 1)
+        position.unmake_move()
+    return counts
+
+
+def run(fen, depth, show_divide=False, out=sys.stdout):
+    position = Position.from_fen(fen)
+    started = time.perf_counter()
+    if show_divide:
+        counts = divide(position, depth)
+        for move in sorted(counts):
+            print(f"{move}: {counts[move]}", file=out)
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(position, depth)
+    elapsed = time.perf_counter() - started
+    nps = nodes / elapsed if elapsed > 0 else 0.0
+    print(f"depth {depth}: {nodes} nodes in {elapsed:.3f}s ({nps:,.0f} nps)", file=out)
+    return nodes, elapsed
+
+
+def run_suite(max_nodes=200000, out=sys.stdout):
+    # Check every reference position up to the deepest count within max_nodes.
+    # Returns the number of mismatches so callers can fail a build on it
+    failures = 0
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, counts in REFERENCE_POSITIONS:
+        position = Position.from_fen(fen)
+        for depth, expected in enumerate(counts, start=1):
+            if expected > max_nodes:
+                break
+            started = time.perf_counter()
+            nodes = perft(position, depth)
+            elapsed = time.perf_counter() - started
+            total_nodes += nodes
+            total_time += elapsed
+            status = 'ok' if nodes == expected else f'FAIL (expected {expected})'
+            print(f"{name} depth {depth}: {nodes} {status} [{elapsed:.3f}s]", file=out)
+            if nodes != expected:
+                failures += 1
+    nps = total_nodes / total_time if total_time > 0 else 0.0
+    print(f"{total_nodes} nodes in {total_time:.3f}s ({nps:,.0f} nps), {failures} failure(s)", file=out)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count move-generator leaf nodes (perft).")
+    parser.add_argument('--fen', default=START_FEN, help="position to search (default: starting position)")
+    parser.add_argument('--depth', type=int, default=3, help="search depth in plies")
+    parser.add_argument('--divide', action='store_true', help="print the node count below each root move")
+    parser.add_argument('--suite', action='store_true', help="check the reference positions against known counts")
+    parser.add_argument('--max-nodes', type=int, default=200000,
+                        help="with --suite, skip depths whose expected count exceeds this")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 1 if run_suite(args.max_nodes) else 0
+    run(args.fen, args.depth, args.divide)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
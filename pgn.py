@@ -0,0 +1,258 @@
+"""PGN import and export for rules.Position.
+
+read_games() is a generator over the lines of a PGN file.  It keeps only
+the game it is currently reading, so arbitrarily large databases can be
+walked in constant memory:
+
+    with open_pgn("archive.pgn") as lines:
+        for game in read_games(lines):
+            for move, position in replay(game):
+                ...
+
+SAN (standard algebraic notation) is produced by move_to_san and read by
+parse_san.  Run the module on one or more files to check every game in them:
+
+    python pgn.py archive.pgn
+"""
+
+import collections
+import re
+import sys
+
+from rules import (BISHOP, KING, KNIGHT, PAWN, QUEEN, ROOK, START_FEN, Position, parse_square,
+                   square_name)
+
+SAN_LETTERS = {KNIGHT: 'N', BISHOP: 'B', ROOK: 'R', QUEEN: 'Q', KING: 'K'}
+SAN_PIECES = {letter: piece_type for piece_type, letter in SAN_LETTERS.items()}
+PROMOTION_LETTERS = {'queen': 'Q', 'rook': 'R', 'bishop': 'B', 'knight': 'N'}
+PROMOTION_NAMES = {letter: name for name, letter in PROMOTION_LETTERS.items()}
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+SEVEN_TAG_ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+
+HEADER_RE = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TOKEN_RE = re.compile(r'\{[^}]*\}?|;.*|\(|\)|\$\d+|\d+\.+|[^\s{}();]+')
+SAN_RE = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBN]))?$')
+
+Game = collections.namedtuple('Game', 'headers moves result')
+
+
+class PGNError(ValueError):
+    pass
+
+
+def _is_capture(position, move):
+    start, dest, _ = move
+    return bool(position.squares[dest]) or (position.squares[start] & 7 == PAWN
+                                            and dest == position.en_passant_square)
+
+
+def move_to_san(position, move, legal_moves=None):
+    start, dest, promotion = move
+    code = position.squares[start]
+    piece_type = code & 7
+    if piece_type == KING and abs(dest - start) == 2:
+        san = 'O-O' if dest > start else 'O-O-O'
+    elif piece_type == PAWN:
+        san = square_name(start)[0] + 'x' if _is_capture(position, move) else ''
+        san += square_name(dest)
+        if promotion:
+            san += '=' + PROMOTION_LETTERS[promotion]
+    else:
+        if legal_moves is None:
+            legal_moves = position.legal_moves()
+        # Name the file, the rank or both when another piece of the same kind
+        # could also reach the destination
+        rivals = {other for other, other_dest, _ in legal_moves
+                  if other_dest == dest and other != start and position.squares[other] == code}
+        disambiguation = ''
+        if rivals:
+            if all(other % 8 != start % 8 for other in rivals):
+                disambiguation = square_name(start)[0]
+            elif all(other // 8 != start // 8 for other in rivals):
+                disambiguation = square_name(start)[1]
+            else:
+                disambiguation = square_name(start)
+        san = SAN_LETTERS[piece_type] + disambiguation
+        san += 'x' if _is_capture(position, move) else ''
+        san += square_name(dest)
+
+    position.make_move(move)
+    if position.is_king_in_check(position.turn):
+        san += '#' if not position.has_legal_moves() else '+'
+    position.unmake_move()
+    return san
+
+
+def parse_san(position, san, legal_moves=None):
+    text = san.rstrip('+#!?')
+    if legal_moves is None:
+        legal_moves = position.legal_moves()
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        king_square = position.king_squares[position.turn]
+        offset = 2 if text in ('O-O', '0-0') else -2
+        candidates = [move for move in legal_moves
+                      if move[0] == king_square and move[1] == king_square + offset]
+    else:
+        match = SAN_RE.match(text)
+        if match is None:
+            raise PGNError(f"Unreadable move {san!r}")
+        letter, file, rank, dest, promotion = match.groups()
+        piece_type = SAN_PIECES[letter] if letter else PAWN
+        dest = parse_square(dest)
+        promotion = PROMOTION_NAMES[promotion] if promotion else ''
+        candidates = []
+        for move in legal_moves:
+            start = move[0]
+            if move[1] != dest or position.squares[start] & 7 != piece_type:
+                continue
+            if move[2] and move[2] != (promotion or 'queen'):
+                continue
+            if file and square_name(start)[0] != file:
+                continue
+            if rank and square_name(start)[1] != rank:
+                continue
+            candidates.append(move)
+    if len(candidates) != 1:
+        problem = "Illegal" if not candidates else "Ambiguous"
+        raise PGNError(f"{problem} move {san!r} in position {position.fen()}")
+    return candidates[0]
+
+
+def game_result(position):
+    if not position.has_legal_moves():
+        if position.is_king_in_check(position.turn):
+            return '0-1' if position.turn == 'white' else '1-0'
+        return '1/2-1/2'
+    if position.halfmove_clock >= 100 or position.is_threefold_repetition():
+        return '1/2-1/2'
+    return '*'
+
+
+def export_pgn(position, headers=None):
+    # PGN text for the game that led to the position, replayed from its start
+    start = position.copy()
+    while start.move_history:
+        start.unmake_move()
+    tags = {name: '?' for name in SEVEN_TAG_ROSTER}
+    tags['Result'] = game_result(position)
+    start_fen = start.fen()
+    if start_fen != START_FEN:
+        tags['SetUp'] = '1'
+        tags['FEN'] = start_fen
+    tags.update(headers or {})
+
+    words = []
+    for move in position.move_history:
+        if start.turn == 'white':
+            words.append(f"{start.fullmove_number}.")
+        elif not words:
+            words.append(f"{start.fullmove_number}...")
+        words.append(move_to_san(start, move))
+        start.make_move(move)
+    words.append(tags['Result'])
+
+    lines = [f'[{name} "{value}"]' for name, value in
+             ((name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in tags.items())]
+    lines.append('')
+    line = ''
+    for word in words:
+        if line and len(line) + 1 + len(word) > 79:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def open_pgn(path):
+    # PGN files in the wild are not always valid UTF-8
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def read_games(lines):
+    headers, moves = {}, []
+    in_movetext = False
+    in_comment = False  # Inside a { } comment that spans lines
+    depth = 0  # Nesting of ( ) variations, which are skipped
+    for line in lines:
+        if in_comment:
+            end = line.find('}')
+            if end < 0:
+                continue
+            line = line[end + 1:]
+            in_comment = False
+        stripped = line.strip()
+        if not stripped or stripped.startswith('%'):
+            continue
+        if stripped.startswith('[') and depth == 0:
+            if in_movetext:
+                # A new game started without the previous one giving a result
+                yield Game(headers, moves, '*')
+                headers, moves, in_movetext = {}, [], False
+            match = HEADER_RE.match(stripped)
+            if match:
+                headers[match.group(1)] = re.sub(r'\\(.)', r'\1', match.group(2))
+            continue
+
+        in_movetext = True
+        for token in TOKEN_RE.findall(line):
+            if token.startswith('{'):
+                in_comment = not token.endswith('}')
+                continue
+            if token.startswith(';') or token.startswith('$') or token[0].isdigit() and token.endswith('.'):
+                continue
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth = max(depth - 1, 0)
+            elif depth:
+                continue
+            elif token in RESULTS:
+                yield Game(headers, moves, token)
+                headers, moves, in_movetext = {}, [], False
+            else:
+                moves.append(token)
+    if in_movetext or headers:
+        yield Game(headers, moves, '*')
+
+
+def start_position(game):
+    if 'FEN' in game.headers:
+        return Position.from_fen(game.headers['FEN'])
+    return Position()
+
+
+def replay(game, position=None):
+    # Play the game's moves through the rules engine, yielding (move, position)
+    # after each one.  The same Position object is updated in place
+    if position is None:
+        position = start_position(game)
+    for san in game.moves:
+        move = parse_san(position, san)
+        position.make_move(move)
+        yield move, position
+
+
+def main(argv=None):
+    paths = sys.argv[1:] if argv is None else argv
+    if not paths:
+        print("usage: python pgn.py FILE.pgn [FILE.pgn ...]", file=sys.stderr)
+        return 2
+    valid = invalid = 0
+    for path in paths:
+        with open_pgn(path) as lines:
+            for number, game in enumerate(read_games(lines), start=1):
+                try:
+                    for _ in replay(game):
+                        pass
+                    valid += 1
+                except ValueError as error:  # A PGNError, or a bad [FEN] header from start_position
+                    invalid += 1
+                    print(f"{path} game {number}: {error}", file=sys.stderr)
+    print(f"{valid} valid game(s), {invalid} invalid")
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
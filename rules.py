@@ -0,0 +1,641 @@
+"""Chess rules engine used by ChessGame.
+
+Nothing in here touches tkinter or PIL, so positions can be set up and
+moves validated in a plain Python process.
+
+Squares are numbered 0-63 as row * 8 + col, with row 0 holding black's back
+rank just like ChessGame's board.  A position stores its pieces in a 64-byte
+bytearray of small piece codes (colour bit | piece type); the familiar 8x8
+list of strings such as 'whitequeen' is available through Position.board
+and encode_board/decode_board.  A move is a (start, dest, promotion) tuple
+where promotion is '' or the piece a pawn turns into.
+"""
+
+import random
+
+COLORS = ('white', 'black')
+PIECE_ORDER = ['rook', 'knight', 'bishop', 'queen', 'king', 'bishop', 'knight', 'rook']
+PROMOTION_PIECES = ('queen', 'rook', 'bishop', 'knight')
+
+# Piece codes: the colour bit combined with the piece type, 0 for an empty square
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE, BLACK = 0, 8
+COLOR_BITS = {'white': WHITE, 'black': BLACK}
+PIECE_TYPES = ('', 'pawn', 'knight', 'bishop', 'rook', 'queen', 'king')
+PIECE_VALUES = (0, 1, 3, 3, 5, 9, 0)  # Material points by piece type
+PIECE_NAMES = [''] * 15  # piece code -> identifier such as 'whitequeen'
+PIECE_CODES = {'': EMPTY}  # identifier -> piece code
+for _color, _bit in COLOR_BITS.items():
+    for _type in range(PAWN, KING + 1):
+        PIECE_NAMES[_bit | _type] = _color + PIECE_TYPES[_type]
+        PIECE_CODES[_color + PIECE_TYPES[_type]] = _bit | _type
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+FEN_LETTERS = ' pnbrqk'  # FEN letter by piece type, upper case for white
+
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+FEN_CASTLING = (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE), ('k', BLACK_KINGSIDE), ('q', BLACK_QUEENSIDE))
+
+# Castling right lost when a piece leaves or lands on one of these squares
+CASTLING_SQUARES = {
+    60: WHITE_KINGSIDE | WHITE_QUEENSIDE,
+    63: WHITE_KINGSIDE,
+    56: WHITE_QUEENSIDE,
+    4: BLACK_KINGSIDE | BLACK_QUEENSIDE,
+    7: BLACK_KINGSIDE,
+    0: BLACK_QUEENSIDE,
+}
+
+# King destination -> (right needed, rook start, rook destination, squares that must be empty)
+CASTLING_MOVES = {
+    62: (WHITE_KINGSIDE, 63, 61, (61, 62)),
+    58: (WHITE_QUEENSIDE, 56, 59, (57, 58, 59)),
+    6: (BLACK_KINGSIDE, 7, 5, (5, 6)),
+    2: (BLACK_QUEENSIDE, 0, 3, (1, 2, 3)),
+}
+
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+
+def _build_rays(directions):
+    # For every square, the squares reached by walking each direction to the edge
+    rays = []
+    for row in range(8):
+        for col in range(8):
+            square_rays = []
+            for step_row, step_col in directions:
+                ray = []
+                r, c = row + step_row, col + step_col
+                while 0 <= r < 8 and 0 <= c < 8:
+                    ray.append(r * 8 + c)
+                    r += step_row
+                    c += step_col
+                if ray:
+                    square_rays.append(tuple(ray))
+            rays.append(tuple(square_rays))
+    return rays
+
+
+def _build_hops(offsets):
+    hops = []
+    for row in range(8):
+        for col in range(8):
+            hops.append(tuple((row + dr) * 8 + col + dc for dr, dc in offsets
+                              if 0 <= row + dr < 8 and 0 <= col + dc < 8))
+    return hops
+
+
+# Precomputed move tables indexed by square
+ROOK_RAYS = _build_rays(ROOK_DIRECTIONS)
+BISHOP_RAYS = _build_rays(BISHOP_DIRECTIONS)
+QUEEN_RAYS = [rook + bishop for rook, bishop in zip(ROOK_RAYS, BISHOP_RAYS)]
+KNIGHT_HOPS = _build_hops(KNIGHT_OFFSETS)
+KING_HOPS = _build_hops(KING_OFFSETS)
+SLIDER_RAYS = {BISHOP: BISHOP_RAYS, ROOK: ROOK_RAYS, QUEEN: QUEEN_RAYS}
+# Squares a pawn of each colour captures onto, indexed by colour bit then square
+PAWN_CAPTURES = {
+    WHITE: _build_hops(((-1, -1), (-1, 1))),
+    BLACK: _build_hops(((1, -1), (1, 1))),
+}
+
+# Zobrist keys.  The generator is seeded so every process, and every saved
+# book or table keyed on these hashes, agrees on the same values
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = [[_zobrist_random.getrandbits(64) for _ in range(64)] for _ in range(15)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for _ in range(16)]
+ZOBRIST_EN_PASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]
+ZOBRIST_CASTLING[0] = 0
+
+
+def opponent(color):
+    return 'black' if color == 'white' else 'white'
+
+
+def square_name(square):
+    row, col = divmod(square, 8)
+    return 'abcdefgh'[col] + str(8 - row)
+
+
+def parse_square(name):
+    if len(name) != 2 or name[0] not in 'abcdefgh' or name[1] not in '12345678':
+        raise ValueError(f"Invalid square: {name!r}")
+    col = 'abcdefgh'.index(name[0])
+    row = 8 - int(name[1])
+    return row * 8 + col
+
+
+def move_to_uci(move):
+    start, dest, promotion = move
+    text = square_name(start) + square_name(dest)
+    if promotion:
+        text += 'n' if promotion == 'knight' else promotion[0]
+    return text
+
+
+def parse_uci(text):
+    promotion = ''
+    if len(text) == 5:
+        promotion = {'q': 'queen', 'r': 'rook', 'b': 'bishop', 'n': 'knight'}.get(text[4].lower())
+        if promotion is None:
+            raise ValueError(f"Invalid UCI move: {text!r}")
+    return (parse_square(text[0:2]), parse_square(text[2:4]), promotion)
+
+
+def encode_board(board):
+    # 8x8 list of piece identifiers -> 64-byte bytearray of piece codes
+    return bytearray(PIECE_CODES[piece] for row in board for piece in row)
+
+
+def decode_board(squares):
+    # 64 piece codes -> 8x8 list of piece identifiers, as used by ChessGame
+    return [[PIECE_NAMES[code] for code in squares[row * 8:row * 8 + 8]] for row in range(8)]
+
+
+class Position:
+    def __init__(self, setup=True):
+        self.squares = bytearray(64)
+        self.turn = 'white'
+        self.castling_rights = 0
+        self.en_passant_square = None  # Square a pawn can capture onto
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.move_history = []
+        self._undo_stack = []  # One undo record per move in move_history
+        # Kept up to date by make_move/unmake_move rather than rescanning the board
+        self.king_squares = {'white': None, 'black': None}
+        self.piece_squares = [set() for _ in range(15)]  # piece code -> squares it occupies
+        self.material = {'white': 0, 'black': 0}
+        self.zobrist = 0  # 64-bit position hash, see compute_hash
+        if setup:
+            self.setup_pieces()
+
+    @property
+    def board(self):
+        return decode_board(self.squares)
+
+    @board.setter
+    def board(self, board):
+        self.squares = encode_board(board)
+        self.index_pieces()
+
+    @property
+    def kings_position(self):
+        return {color: None if square is None else divmod(square, 8)
+                for color, square in self.king_squares.items()}
+
+    def piece_at(self, row, col):
+        return PIECE_NAMES[self.squares[row * 8 + col]]
+
+    def copy(self):
+        other = Position(setup=False)
+        other.squares = self.squares[:]
+        other.turn = self.turn
+        other.castling_rights = self.castling_rights
+        other.en_passant_square = self.en_passant_square
+        other.halfmove_clock = self.halfmove_clock
+        other.fullmove_number = self.fullmove_number
+        other.move_history = self.move_history[:]
+        other._undo_stack = self._undo_stack[:]
+        other.king_squares = dict(self.king_squares)
+        other.piece_squares = [set(squares) for squares in self.piece_squares]
+        other.material = dict(self.material)
+        other.zobrist = self.zobrist
+        return other
+
+    def pack(self):
+        # Compact, hashable snapshot: 64 piece codes, side to move, castling
+        # rights and en passant square (64 when there is none)
+        en_passant = 64 if self.en_passant_square is None else self.en_passant_square
+        return bytes(self.squares) + bytes((COLOR_BITS[self.turn], self.castling_rights, en_passant))
+
+    @classmethod
+    def unpack(cls, data):
+        position = cls(setup=False)
+        position.squares = bytearray(data[:64])
+        position.turn = 'white' if data[64] == WHITE else 'black'
+        position.castling_rights = data[65]
+        position.en_passant_square = None if data[66] == 64 else data[66]
+        position.index_pieces()
+        return position
+
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError(f"Invalid FEN: {fen!r}")
+        position = cls(setup=False)
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError(f"Invalid FEN board: {fields[0]!r}")
+        for row, text in enumerate(rows):
+            col = 0
+            for char in text:
+                if char in '12345678':
+                    col += int(char)
+                elif char.lower() in FEN_LETTERS[1:] and col < 8:
+                    color_bit = WHITE if char.isupper() else BLACK
+                    position.squares[row * 8 + col] = color_bit | FEN_LETTERS.index(char.lower())
+                    col += 1
+                else:
+                    raise ValueError(f"Invalid FEN board: {fields[0]!r}")
+            if col != 8:
+                raise ValueError(f"Invalid FEN board: {fields[0]!r}")
+        if fields[1] not in ('w', 'b'):
+            raise ValueError(f"Invalid FEN side to move: {fields[1]!r}")
+        position.turn = 'white' if fields[1] == 'w' else 'black'
+        if fields[2] != '-' and (len(set(fields[2])) != len(fields[2]) or not set(fields[2]) <= set('KQkq')):
+            raise ValueError(f"Invalid FEN castling rights: {fields[2]!r}")
+        for char, right in FEN_CASTLING:
+            if char in fields[2]:
+                position.castling_rights |= right
+        if any(code & 7 == PAWN for code in position.squares[:8] + position.squares[56:]):
+            raise ValueError(f"Invalid FEN board: pawn on the first or last rank: {fields[0]!r}")
+        if fields[3] != '-':
+            # The square a pawn of the side not to move has just skipped over:
+            # that pawn stands beyond it, and the square and the one it left are empty
+            rank = '6' if position.turn == 'white' else '3'
+            if len(fields[3]) != 2 or fields[3][0] not in 'abcdefgh' or fields[3][1] != rank:
+                raise ValueError(f"Invalid FEN en passant square: {fields[3]!r}")
+            square = parse_square(fields[3])
+            step = 8 if position.turn == 'white' else -8
+            pawn = (BLACK if position.turn == 'white' else WHITE) | PAWN
+            squares = position.squares
+            if squares[square] or squares[square - step] or squares[square + step] != pawn:
+                raise ValueError(f"Invalid FEN en passant square: {fields[3]!r}")
+            position.en_passant_square = square
+        if len(fields) > 6:
+            raise ValueError(f"Invalid FEN: {fen!r}")
+        try:
+            clocks = [int(field) for field in fields[4:]]
+        except ValueError:
+            raise ValueError(f"Invalid FEN move counters: {' '.join(fields[4:])!r}") from None
+        if any(clock < 0 for clock in clocks) or len(clocks) == 2 and clocks[1] < 1:
+            raise ValueError(f"Invalid FEN move counters: {' '.join(fields[4:])!r}")
+        if clocks:
+            position.halfmove_clock = clocks[0]
+        if len(clocks) == 2:
+            position.fullmove_number = clocks[1]
+        position.index_pieces()
+        if any(len(position.piece_squares[color_bit | KING]) != 1 for color_bit in (WHITE, BLACK)):
+            raise ValueError(f"Invalid FEN board: each side needs one king: {fields[0]!r}")
+        return position
+
+    def fen(self):
+        rows = []
+        for row in range(8):
+            text, empty = '', 0
+            for code in self.squares[row * 8:row * 8 + 8]:
+                if not code:
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                letter = FEN_LETTERS[code & 7]
+                text += letter if code & BLACK else letter.upper()
+            rows.append(text + (str(empty) if empty else ''))
+        castling = ''.join(char for char, right in FEN_CASTLING if self.castling_rights & right)
+        en_passant = '-' if self.en_passant_square is None else square_name(self.en_passant_square)
+        return ' '.join(('/'.join(rows), self.turn[0], castling or '-', en_passant,
+                         str(self.halfmove_clock), str(self.fullmove_number)))
+
+    def setup_pieces(self):
+        self.squares = bytearray(64)
+        for i in range(8):
+            self.squares[i] = PIECE_CODES[f'black{PIECE_ORDER[i]}']
+            self.squares[8 + i] = BLACK | PAWN
+            self.squares[48 + i] = WHITE | PAWN
+            self.squares[56 + i] = PIECE_CODES[f'white{PIECE_ORDER[i]}']
+        self.turn = 'white'
+        self.castling_rights = ALL_CASTLING
+        self.en_passant_square = None
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.move_history = []
+        self._undo_stack = []
+        self.index_pieces()
+
+    def index_pieces(self):
+        # Rebuild king squares, piece lists and material from scratch; only
+        # needed when a whole board is loaded, moves keep them up to date
+        self.king_squares = {'white': None, 'black': None}
+        self.piece_squares = [set() for _ in range(15)]
+        self.material = {'white': 0, 'black': 0}
+        for square, code in enumerate(self.squares):
+            if code:
+                color = COLORS[code >> 3]
+                self.piece_squares[code].add(square)
+                self.material[color] += PIECE_VALUES[code & 7]
+                if code & 7 == KING:
+                    self.king_squares[color] = square
+        self.zobrist = self.compute_hash()
+
+    def compute_hash(self):
+        # Hash of the pieces, side to move, castling rights and en passant
+        # file.  make_move keeps self.zobrist equal to this incrementally
+        key = 0
+        for square, code in enumerate(self.squares):
+            if code:
+                key ^= ZOBRIST_PIECES[code][square]
+        if self.turn == 'black':
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ ZOBRIST_CASTLING[self.castling_rights] ^ self._en_passant_key()
+
+    def _en_passant_key(self):
+        # The en passant file only counts when a pawn can actually capture
+        # there, so otherwise identical positions hash the same
+        square = self.en_passant_square
+        if square is None:
+            return 0
+        capturer_bit = COLOR_BITS[self.turn]
+        pawn = capturer_bit | PAWN
+        for source in PAWN_CAPTURES[capturer_bit ^ BLACK][square]:
+            if self.squares[source] == pawn:
+                return ZOBRIST_EN_PASSANT[square % 8]
+        return 0
+
+    def can_capture_en_passant(self):
+        # Whether a pawn of the side to move stands next to the en passant square
+        return bool(self._en_passant_key())
+
+    def repetition_count(self):
+        # How many times the current position has occurred, counting this one.
+        # Only positions since the last capture or pawn move can repeat
+        count = 1
+        stack = self._undo_stack
+        for i in range(len(stack) - 2, max(len(stack) - self.halfmove_clock, 0) - 1, -2):
+            if stack[i][-1] == self.zobrist:
+                count += 1
+        return count
+
+    def is_threefold_repetition(self):
+        return self.repetition_count() >= 3
+
+    def pieces(self, color):
+        # (square, piece code) for every piece of the colour, from the piece lists
+        color_bit = COLOR_BITS[color]
+        return [(square, code) for code in range(color_bit + PAWN, color_bit + KING + 1)
+                for square in self.piece_squares[code]]
+
+    def piece_count(self, piece_identifier):
+        return len(self.piece_squares[PIECE_CODES[piece_identifier]])
+
+    def _is_attacked(self, square, attacker_bit):
+        squares = self.squares
+        knight = attacker_bit | KNIGHT
+        for source in KNIGHT_HOPS[square]:
+            if squares[source] == knight:
+                return True
+        # An attacking pawn stands where a defending pawn would capture from
+        pawn = attacker_bit | PAWN
+        for source in PAWN_CAPTURES[attacker_bit ^ BLACK][square]:
+            if squares[source] == pawn:
+                return True
+        king = attacker_bit | KING
+        for source in KING_HOPS[square]:
+            if squares[source] == king:
+                return True
+        queen = attacker_bit | QUEEN
+        for rays, slider in ((ROOK_RAYS, attacker_bit | ROOK), (BISHOP_RAYS, attacker_bit | BISHOP)):
+            for ray in rays[square]:
+                for source in ray:
+                    code = squares[source]
+                    if code:
+                        if code == slider or code == queen:
+                            return True
+                        break
+        return False
+
+    def is_square_attacked(self, square, attacker_color):
+        # Whether any attacker_color piece hits the square (0-63)
+        return self._is_attacked(square, COLOR_BITS[attacker_color])
+
+    def is_king_in_check(self, king_color):
+        king_square = self.king_squares[king_color]
+        if king_square is None:
+            return False
+        return self._is_attacked(king_square, COLOR_BITS[king_color] ^ BLACK)
+
+    def _can_castle(self, color_bit, start, dest):
+        castling = CASTLING_MOVES.get(dest)
+        if castling is None or start != (60 if color_bit == WHITE else 4) or dest // 8 != start // 8:
+            return False
+        right, rook_start, rook_dest, empty_squares = castling
+        if not self.castling_rights & right or self.squares[start] != color_bit | KING:
+            return False
+        if self.squares[rook_start] != color_bit | ROOK:
+            return False
+        if any(self.squares[square] for square in empty_squares):
+            return False
+        # The king may not castle out of, through or into check
+        enemy_bit = color_bit ^ BLACK
+        for square in (start, rook_dest, dest):
+            if self._is_attacked(square, enemy_bit):
+                return False
+        return True
+
+    def _piece_moves(self, start):
+        # Pseudo-legal destinations for the piece on the square, walked from
+        # the precomputed tables rather than probing every square
+        squares = self.squares
+        code = squares[start]
+        color_bit, piece_type = code & BLACK, code & 7
+        moves = []
+        if piece_type == PAWN:
+            step = -8 if color_bit == WHITE else 8
+            dest = start + step
+            if 0 <= dest < 64:
+                if not squares[dest]:
+                    moves.append(dest)
+                    home_row = 6 if color_bit == WHITE else 1
+                    if start // 8 == home_row and not squares[dest + step]:
+                        moves.append(dest + step)
+                for dest in PAWN_CAPTURES[color_bit][start]:
+                    target = squares[dest]
+                    if (target and target & BLACK != color_bit) or dest == self.en_passant_square:
+                        moves.append(dest)
+        elif piece_type == KNIGHT or piece_type == KING:
+            for dest in (KNIGHT_HOPS if piece_type == KNIGHT else KING_HOPS)[start]:
+                target = squares[dest]
+                if not target or target & BLACK != color_bit:
+                    moves.append(dest)
+            if piece_type == KING and self.castling_rights:
+                for dest in (start + 2, start - 2):
+                    if self._can_castle(color_bit, start, dest):
+                        moves.append(dest)
+        else:
+            for ray in SLIDER_RAYS[piece_type][start]:
+                for dest in ray:
+                    target = squares[dest]
+                    if not target:
+                        moves.append(dest)
+                        continue
+                    if target & BLACK != color_bit:
+                        moves.append(dest)
+                    break
+        return moves
+
+    def pseudo_legal_moves(self):
+        moves = []
+        for start, code in self.pieces(self.turn):
+            promoting = code & 7 == PAWN and start // 8 in (1, 6)
+            for dest in self._piece_moves(start):
+                if promoting and dest // 8 in (0, 7):
+                    for promotion in PROMOTION_PIECES:
+                        moves.append((start, dest, promotion))
+                else:
+                    moves.append((start, dest, ''))
+        return moves
+
+    def is_legal(self, move):
+        # Whether the (start, dest, promotion) move is legal here, without
+        # generating the whole move list; the position is left as it was
+        start, dest, promotion = move
+        if not (0 <= start < 64 and 0 <= dest < 64):
+            return False
+        code = self.squares[start]
+        if not code or code & BLACK != COLOR_BITS[self.turn]:
+            return False
+        # A pawn reaching the last rank must name its promotion and nothing else may
+        if code & 7 == PAWN and dest // 8 in (0, 7):
+            if promotion not in PROMOTION_PIECES:
+                return False
+        elif promotion:
+            return False
+        if dest not in self._piece_moves(start):
+            return False
+        return not self._leaves_king_in_check(start, dest)
+
+    def _leaves_king_in_check(self, start, dest):
+        color = self.turn
+        self.make_move((start, dest, ''))
+        in_check = self.is_king_in_check(color)
+        self.unmake_move()
+        return in_check
+
+    def legal_moves(self):
+        return [move for move in self.pseudo_legal_moves()
+                if not self._leaves_king_in_check(move[0], move[1])]
+
+    def has_legal_moves(self):
+        for start, code in self.pieces(self.turn):
+            for dest in self._piece_moves(start):
+                if not self._leaves_king_in_check(start, dest):
+                    return True
+        return False
+
+    def is_checkmate(self):
+        return self.is_king_in_check(self.turn) and not self.has_legal_moves()
+
+    def is_stalemate(self):
+        return not self.is_king_in_check(self.turn) and not self.has_legal_moves()
+
+    def apply_move(self, start_row, start_col, dest_row, dest_col, promotion='queen'):
+        # Move the piece without checking legality; callers validate first
+        return PIECE_NAMES[self.make_move((start_row * 8 + start_col, dest_row * 8 + dest_col, promotion))]
+
+    def make_move(self, move):
+        # Apply a move without checking legality and push an undo record so
+        # unmake_move can take it back without copying the board
+        start, dest, promotion = move
+        squares = self.squares
+        code = squares[start]
+        color_bit, piece_type = code & BLACK, code & 7
+        capture_square = dest
+        if piece_type == PAWN and dest == self.en_passant_square:
+            # En passant: the captured pawn sits beside the moving pawn
+            capture_square = dest + 8 if color_bit == WHITE else dest - 8
+        captured = squares[capture_square]
+        self._undo_stack.append((start, dest, code, captured, capture_square,
+                                 self.castling_rights, self.en_passant_square, self.halfmove_clock,
+                                 self.zobrist))
+
+        color = self.turn
+        piece_squares = self.piece_squares
+        key = self.zobrist ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[self.castling_rights] ^ self._en_passant_key()
+        if captured:
+            key ^= ZOBRIST_PIECES[captured][capture_square]
+            squares[capture_square] = EMPTY
+            piece_squares[captured].remove(capture_square)
+            self.material[COLORS[captured >> 3]] -= PIECE_VALUES[captured & 7]
+        if piece_type == KING and abs(dest - start) == 2:
+            # Castling: bring the rook over to the other side of the king
+            _, rook_start, rook_dest, _ = CASTLING_MOVES[dest]
+            rook = squares[rook_start]
+            key ^= ZOBRIST_PIECES[rook][rook_start] ^ ZOBRIST_PIECES[rook][rook_dest]
+            squares[rook_dest] = rook
+            squares[rook_start] = EMPTY
+            piece_squares[rook].remove(rook_start)
+            piece_squares[rook].add(rook_dest)
+        squares[start] = EMPTY
+        piece_squares[code].remove(start)
+        if piece_type == PAWN and dest // 8 in (0, 7):
+            promotion = promotion or 'queen'
+            placed = PIECE_CODES[color + promotion]
+            self.material[color] += PIECE_VALUES[placed & 7] - PIECE_VALUES[PAWN]
+        else:
+            promotion = ''
+            placed = code
+        squares[dest] = placed
+        piece_squares[placed].add(dest)
+        key ^= ZOBRIST_PIECES[code][start] ^ ZOBRIST_PIECES[placed][dest]
+        if piece_type == KING:
+            self.king_squares[color] = dest
+
+        self.castling_rights &= ~(CASTLING_SQUARES.get(start, 0) | CASTLING_SQUARES.get(dest, 0))
+        if piece_type == PAWN and abs(dest - start) == 16:
+            self.en_passant_square = (start + dest) // 2
+        else:
+            self.en_passant_square = None
+        if piece_type == PAWN or captured:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if color_bit == BLACK:
+            self.fullmove_number += 1
+        self.turn = opponent(color)
+        self.zobrist = key ^ ZOBRIST_CASTLING[self.castling_rights] ^ self._en_passant_key()
+        self.move_history.append((start, dest, promotion))
+        return captured
+
+    def unmake_move(self):
+        # Take back the last make_move and return the move that was undone
+        (start, dest, code, captured, capture_square,
+         self.castling_rights, self.en_passant_square, self.halfmove_clock,
+         self.zobrist) = self._undo_stack.pop()
+        squares = self.squares
+        piece_squares = self.piece_squares
+        color = COLORS[code >> 3]
+        placed = squares[dest]
+        squares[dest] = EMPTY
+        piece_squares[placed].remove(dest)
+        if placed != code:
+            self.material[color] -= PIECE_VALUES[placed & 7] - PIECE_VALUES[PAWN]
+        if captured:
+            squares[capture_square] = captured
+            piece_squares[captured].add(capture_square)
+            self.material[COLORS[captured >> 3]] += PIECE_VALUES[captured & 7]
+        squares[start] = code
+        piece_squares[code].add(start)
+        if code & 7 == KING:
+            self.king_squares[color] = start
+            if abs(dest - start) == 2:
+                _, rook_start, rook_dest, _ = CASTLING_MOVES[dest]
+                rook = squares[rook_dest]
+                squares[rook_start] = rook
+                squares[rook_dest] = EMPTY
+                piece_squares[rook].remove(rook_dest)
+                piece_squares[rook].add(rook_start)
+        if code & BLACK:
+            self.fullmove_number -= 1
+        self.turn = color
+        return self.move_history.pop()
@@ -0,0 +1,295 @@
+"""Headless game server: many games in one process over a TCP line protocol.
+
+Every request is one line of space-separated words and gets exactly one
+reply line, starting with OK or ERR, in the order the requests were sent:
+
+    NEW [seconds [increment]]   OK <game>             new game, untimed without seconds
+    JOIN <game> <white|black>   OK <game> <color>     take a seat; one connection may take both
+    WATCH <game>                OK <game>             receive the game's events
+    MOVE <game> <uci>           OK <game> <san>       once both seats are taken, e.g. MOVE 3 e7e8q
+    STATE <game>                OK <game> <fen> <white ms> <black ms>
+    RESIGN <game>               OK <game>
+    PING                        OK
+
+Players and watchers of a game also receive event lines, interleaved with
+the replies:
+
+    MOVED <game> <uci> <san> <white ms> <black ms>
+    CHECK <game> <color>
+    END <game> <result> <reason>
+
+Clock fields are '-' in untimed games.  A player whose clock runs out loses
+even if they never send another move.  A game is aborted with
+'END <game> * abandoned' when its last player disconnects, or when its
+creator disconnects before anyone has joined.  Moves go through the same
+rules.Position as the ChessGame window.
+
+    python server.py --port 8765
+"""
+
+import argparse
+import asyncio
+import itertools
+import math
+import sys
+
+from batch import decode_move
+from pgn import game_result, move_to_san
+from rules import COLORS, Position, move_to_uci
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Game:
+    def __init__(self, game_id, base=None, increment=0.0):
+        self.id = game_id
+        self.position = Position()
+        self.creator = None  # Connection that sent NEW
+        self.players = {}  # color -> Connection
+        self.watchers = set()
+        self.base = base  # Seconds per side, or None for an untimed game
+        self.increment = increment
+        self.clocks = {color: base for color in COLORS}
+        self.turn_started = None  # Loop time the side to move started thinking
+        self.flag_timer = None
+        self.result = None
+
+    def clock_fields(self, now):
+        if self.base is None:
+            return '- -'
+        fields = []
+        for color in COLORS:
+            remaining = self.clocks[color]
+            if color == self.position.turn and self.turn_started is not None:
+                remaining -= now - self.turn_started
+            fields.append(str(max(int(remaining * 1000), 0)))
+        return ' '.join(fields)
+
+    def connections(self):
+        return set(self.players.values()) | self.watchers
+
+
+class Connection:
+    def __init__(self, writer):
+        self.writer = writer
+        self.games = set()
+
+    def send(self, line):
+        if not self.writer.is_closing():
+            self.writer.write(line.encode() + b'\n')
+
+
+class GameServer:
+    def __init__(self):
+        self.games = {}
+        self.game_ids = itertools.count(1)
+
+    def game(self, game_id):
+        game = self.games.get(game_id)
+        if game is None:
+            raise ProtocolError(f"no game {game_id}")
+        if game.result is not None:
+            raise ProtocolError(f"game {game_id} is over")
+        return game
+
+    def broadcast(self, game, line):
+        for connection in game.connections():
+            connection.send(line)
+
+    def finish(self, game, result, reason):
+        game.result = result
+        if game.flag_timer is not None:
+            game.flag_timer.cancel()
+        self.broadcast(game, f"END {game.id} {result} {reason}")
+        for connection in game.connections():
+            connection.games.discard(game.id)
+        del self.games[game.id]
+
+    def start_clock(self, game):
+        # Charge the side to move from now on, and end the game when its time runs out
+        if game.base is None:
+            return
+        loop = asyncio.get_running_loop()
+        game.turn_started = loop.time()
+        if game.flag_timer is not None:
+            game.flag_timer.cancel()
+        color = game.position.turn
+        game.flag_timer = loop.call_later(game.clocks[color], self.flag_fall, game, color)
+
+    def flag_fall(self, game, color):
+        if game.result is None and game.id in self.games:
+            self.finish(game, '0-1' if color == 'white' else '1-0', 'timeout')
+
+    # Requests: each returns the words after OK, or raises ProtocolError
+
+    def do_new(self, connection, args):
+        base = float(args[0]) if args else None
+        increment = float(args[1]) if len(args) > 1 else 0.0
+        # float() also takes 'inf' and 'nan', which no clock can run on
+        if base is not None and not (math.isfinite(base) and base > 0):
+            raise ProtocolError("bad clock")
+        if not (math.isfinite(increment) and increment >= 0):
+            raise ProtocolError("bad clock")
+        game = Game(str(next(self.game_ids)), base, increment)
+        game.creator = connection
+        self.games[game.id] = game
+        connection.games.add(game.id)  # Aborted if the creator leaves before anyone sits down
+        return game.id
+
+    def do_join(self, connection, args):
+        game = self.game(args[0])
+        color = args[1]
+        if color not in COLORS:
+            raise ProtocolError(f"no colour {color}")
+        seated = game.players.get(color)
+        if seated is not None and seated is not connection:
+            raise ProtocolError(f"{color} is taken")
+        game.players[color] = connection
+        connection.games.add(game.id)
+        if len(game.players) == 2 and game.turn_started is None:
+            self.start_clock(game)
+        return f"{game.id} {color}"
+
+    def do_watch(self, connection, args):
+        game = self.game(args[0])
+        game.watchers.add(connection)
+        connection.games.add(game.id)
+        return game.id
+
+    def do_move(self, connection, args):
+        game = self.game(args[0])
+        position = game.position
+        color = position.turn
+        if game.players.get(color) is not connection:
+            raise ProtocolError("not your turn")
+        if len(game.players) < 2:
+            # The clocks start when both seats are taken
+            raise ProtocolError("waiting for an opponent")
+        try:
+            move = decode_move(args[1])
+        except ValueError:
+            raise ProtocolError(f"bad move {args[1]}")
+        if not position.is_legal(move):
+            raise ProtocolError(f"illegal move {args[1]}")
+
+        now = asyncio.get_running_loop().time()
+        if game.base is not None and game.turn_started is not None:
+            game.clocks[color] -= now - game.turn_started
+            if game.clocks[color] <= 0:
+                # The flag fell before the timer callback got to run
+                self.flag_fall(game, color)
+                raise ProtocolError("out of time")
+            game.clocks[color] += game.increment
+        san = move_to_san(position, move)
+        position.make_move(move)
+        self.start_clock(game)
+        self.broadcast(game, f"MOVED {game.id} {move_to_uci(move)} {san} {game.clock_fields(now)}")
+        check = position.is_king_in_check(position.turn)
+        game_over = not position.has_legal_moves()
+        if check and not game_over:
+            self.broadcast(game, f"CHECK {game.id} {position.turn}")
+        result = game_result(position)
+        if result != '*':
+            if game_over:
+                reason = 'checkmate' if check else 'stalemate'
+            else:
+                reason = 'fifty-move' if position.halfmove_clock >= 100 else 'repetition'
+            # The reply goes out before the END event; no further requests reach the game
+            game.result = result
+            asyncio.get_running_loop().call_soon(self.finish, game, result, reason)
+        return f"{game.id} {san}"
+
+    def do_state(self, connection, args):
+        game = self.game(args[0])
+        return f"{game.id} {game.position.fen()} {game.clock_fields(asyncio.get_running_loop().time())}"
+
+    def do_resign(self, connection, args):
+        game = self.game(args[0])
+        colors = [color for color, player in game.players.items() if player is connection]
+        if not colors:
+            raise ProtocolError("not a player")
+        # A connection seated on both sides resigns for the side to move
+        color = game.position.turn if game.position.turn in colors else colors[0]
+        game.result = '0-1' if color == 'white' else '1-0'
+        asyncio.get_running_loop().call_soon(
+            self.finish, game, game.result, 'resignation')
+        return game.id
+
+    def do_ping(self, connection, args):
+        return ''
+
+    def dispatch(self, connection, line):
+        words = line.split()
+        if not words:
+            return None
+        handler = getattr(self, f"do_{words[0].lower()}", None)
+        if handler is None:
+            return f"ERR unknown command {words[0]}"
+        try:
+            reply = handler(connection, words[1:])
+        except ProtocolError as error:
+            return f"ERR {error}"
+        except (IndexError, ValueError):
+            return f"ERR bad arguments for {words[0].upper()}"
+        return f"OK {reply}" if reply else "OK"
+
+    def disconnect(self, connection):
+        # A game nobody is seated at any more can never finish, so it is
+        # aborted rather than kept forever
+        for game_id in list(connection.games):
+            game = self.games.get(game_id)
+            if game is None:
+                continue
+            game.watchers.discard(connection)
+            seated = False
+            for color, player in list(game.players.items()):
+                if player is connection:
+                    del game.players[color]
+                    seated = True
+            # A watcher leaving never ends a game
+            if (seated or game.creator is connection) and not game.players and game.result is None:
+                self.finish(game, '*', 'abandoned')
+
+    async def handle(self, reader, writer):
+        connection = Connection(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = self.dispatch(connection, line.decode(errors='replace'))
+                if reply is not None:
+                    connection.send(reply)
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.disconnect(connection)
+            writer.close()
+
+
+async def serve(host='127.0.0.1', port=8765, started=None):
+    server = GameServer()
+    listener = await asyncio.start_server(server.handle, host, port, limit=1 << 16)
+    if started is not None:
+        started.set_result(listener.sockets[0].getsockname()[1])
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve chess games over a TCP line protocol.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8765, help="port to listen on")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Piece images for ChessGame, scaled to the current square size.
+
+Scaled copies of the PNGs in Pieces/ are kept in an on-disk cache keyed by
+piece, size and the source file's modification time, so only the first run
+at a given size pays for the LANCZOS resize.  Decoding can be started on a
+background thread with preload(), and ready() tells when it has finished.
+Tk PhotoImages are only ever created on the Tk thread, in get(), which
+waits for a piece the preload is still working on rather than decoding it
+a second time.  The PhotoImages for the most recently used sizes
+stay in memory so resizing the window back and forth is instant.
+"""
+
+import collections
+import os
+import threading
+
+from PIL import Image, ImageTk
+
+PIECES = [f'{color}{piece}' for color in ['white', 'black']
+          for piece in ['pawn', 'rook', 'knight', 'bishop', 'queen', 'king']]
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'chessgame', 'sprites')
+
+
+class SpriteCache:
+    def __init__(self, source_dir="Pieces", cache_dir=None, max_sizes=4):
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_sizes = max_sizes
+        self._photos = collections.OrderedDict()  # size -> {piece: PhotoImage}, least recently used first
+        self._decoded = collections.OrderedDict()  # size -> {piece: PIL image} from preload(), oldest first
+        self._pending = {}  # (piece, size) -> Event set once preload() is done with it
+        self._lock = threading.Lock()
+
+    def _load(self, piece, size):
+        # Scaled PIL image, from the disk cache when it is up to date
+        source = os.path.join(self.source_dir, f"{piece}.png")
+        mtime = os.stat(source).st_mtime_ns
+        cached = os.path.join(self.cache_dir, f"{piece}-{size}-{mtime}.png")
+        try:
+            img = Image.open(cached)
+            img.load()
+            return img
+        except OSError:
+            pass
+        img = Image.open(source)
+        img = img.resize((size, size), Image.LANCZOS)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            partial = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+            img.save(partial, format='PNG')
+            os.replace(partial, cached)  # Never leave a half-written file under the real name
+        except OSError:
+            pass  # An unwritable cache only costs a resize next time
+        return img
+
+    def preload(self, size, pieces=PIECES):
+        # Decode and scale on a worker thread; get() picks the results up.
+        # Call from the Tk thread, like get()
+        photos = self._photos.get(size, {})
+        with self._lock:
+            decoded = self._decoded.setdefault(size, {})
+            self._decoded.move_to_end(size)
+            # Decoded images are kept for as many sizes as the PhotoImages are
+            while len(self._decoded) > self.max_sizes:
+                self._decoded.popitem(last=False)
+            todo = [piece for piece in pieces if piece not in photos
+                    and piece not in decoded and (piece, size) not in self._pending]
+            for piece in todo:
+                self._pending[(piece, size)] = threading.Event()
+        if not todo:
+            return None
+
+        def work():
+            try:
+                for piece in todo:
+                    img = self._load(piece, size)
+                    with self._lock:
+                        decoded = self._decoded.get(size)
+                        if decoded is not None:  # Not dropped for newer sizes meanwhile
+                            decoded[piece] = img
+                        self._pending.pop((piece, size)).set()
+            finally:
+                # Whatever failed is left for get() to load, and report, itself
+                with self._lock:
+                    for piece in todo:
+                        pending = self._pending.pop((piece, size), None)
+                        if pending is not None:
+                            pending.set()
+
+        thread = threading.Thread(target=work, daemon=True)
+        thread.start()
+        return thread
+
+    def ready(self, size):
+        # Whether every preload of the size has finished
+        with self._lock:
+            return not any(pending_size == size for _, pending_size in self._pending)
+
+    def get(self, piece, size):
+        # PhotoImage for the piece at the size; call from the Tk thread only
+        photos = self._photos.get(size)
+        if photos is None:
+            photos = self._photos[size] = {}
+            while len(self._photos) > self.max_sizes:
+                self._photos.popitem(last=False)
+        else:
+            self._photos.move_to_end(size)
+        photo = photos.get(piece)
+        if photo is None:
+            with self._lock:
+                pending = self._pending.get((piece, size))
+            if pending is not None:
+                pending.wait()
+            with self._lock:
+                img = self._decoded.get(size, {}).pop(piece, None)
+            if img is None:
+                img = self._load(piece, size)
+            photo = photos[piece] = ImageTk.PhotoImage(img)
+        return photo
@@ -0,0 +1,445 @@
+"""Endgame tablebases: exact results for positions with few pieces.
+
+A table covers one material balance, such as KQvK or KRPvKR.  It holds one
+16-bit value per placement of the pieces and side to move.  The value is
+0 for a draw, +(n + 1) when the side to move mates in n plies, and -(n + 1)
+when the side to move is mated in n plies.  The file is a small header
+followed by the values, so a probe is one read from a memory-mapped file.
+
+Tables are generated by retrograde analysis.  A forward pass counts the
+legal moves of every position.  It also looks up captures and promotions
+in the smaller tables they lead to, so those are built first.  The
+backward pass then starts from the checkmates and works towards longer and
+longer mates, undoing moves:
+
+- a position with a move into a lost position is won;
+- a position all of whose moves lead to won positions is lost;
+- whatever is left at the end is a draw.
+
+Tables assume no castling rights and no en passant capture.  The 50-move
+rule is ignored.  In pure Python three pieces take about a minute, four
+pieces take hours, and five are out of reach.
+
+    python tablebase.py build KQvK KRvK KPvK
+    python tablebase.py probe --fen "8/8/8/4k3/8/8/8/4KQ2 w - - 0 1"
+"""
+
+import argparse
+import array
+import collections
+import concurrent.futures
+import mmap
+import os
+import struct
+import sys
+import time
+
+from rules import (BISHOP, BLACK, FEN_LETTERS, KING, KING_HOPS, KNIGHT, KNIGHT_HOPS, PAWN, PIECE_VALUES, QUEEN, ROOK,
+                   SLIDER_RAYS, WHITE, Position, move_to_uci, opponent)
+
+MAGIC = b'CTB1'
+HEADER = struct.Struct('<4s16sB')  # magic, material name, number of pieces
+VALUE = struct.Struct('<h')
+PIECE_LETTERS = 'KQRBNP'
+LETTER_TYPES = {'K': KING, 'Q': QUEEN, 'R': ROOK, 'B': BISHOP, 'N': KNIGHT, 'P': PAWN}
+INSUFFICIENT = ('KvK', 'KBvK', 'KNvK')  # No mate is possible, so no table is needed
+INVALID = 255  # Legal move count of a placement that can't occur
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tablebases')
+
+Probe = collections.namedtuple('Probe', 'wdl dtm')  # 1/0/-1 for the side to move; plies to mate or None
+
+
+def _side_strength(letters):
+    return sum(PIECE_VALUES[LETTER_TYPES[letter]] for letter in letters), \
+        [-PIECE_LETTERS.index(letter) for letter in letters]
+
+
+def canonical_material(white, black):
+    # Table name for the two sides' letters (kings included) and whether the
+    # colours are swapped to put the stronger side first as white
+    white = ''.join(sorted(white, key=PIECE_LETTERS.index))
+    black = ''.join(sorted(black, key=PIECE_LETTERS.index))
+    if _side_strength(black) > _side_strength(white):
+        return f"{black}v{white}", True
+    return f"{white}v{black}", False
+
+
+def material_of(position):
+    letters = {WHITE: '', BLACK: ''}
+    for code, squares in enumerate(position.piece_squares):
+        if squares:
+            letters[code & BLACK] += FEN_LETTERS[code & 7].upper() * len(squares)
+    return canonical_material(letters[WHITE], letters[BLACK])
+
+
+def piece_groups(name):
+    # [(piece code, count)] in index order: white king, white pieces, black king, black pieces
+    white, black = name.split('v')
+    groups = []
+    for color_bit, letters in ((WHITE, white), (BLACK, black)):
+        for letter in sorted(set(letters), key=PIECE_LETTERS.index):
+            groups.append((color_bit | LETTER_TYPES[letter], letters.count(letter)))
+    return groups
+
+
+def sub_materials(name):
+    # Tables reachable by one capture or promotion
+    white, black = name.split('v')
+    found = set()
+    for side, other, swap in ((white, black, False), (black, white, True)):
+        for i, letter in enumerate(side):
+            if letter == 'K':
+                continue
+            rest = side[:i] + side[i + 1:]
+            # Captured by the other side, or promoted to a new piece
+            options = [rest] + ([rest + new for new in 'QRBN'] if letter == 'P' else [])
+            for option in options:
+                found.add(canonical_material(other, option) if swap else canonical_material(option, other))
+    return sorted(material for material, _ in found)
+
+
+def table_path(directory, name):
+    return os.path.join(directory, f"{name}.tb")
+
+
+def encode_value(probe):
+    if probe.wdl == 0:
+        return 0
+    return probe.wdl * (probe.dtm + 1)
+
+
+def decode_value(value):
+    if value == 0:
+        return Probe(0, None)
+    return Probe(1, value - 1) if value > 0 else Probe(-1, -value - 1)
+
+
+class Table:
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, name, pieces = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.data.close()
+            raise ValueError(f"{path} is not a tablebase file")
+        self.name = name.rstrip(b'\0').decode()
+        self.pieces = pieces
+        self.groups = piece_groups(self.name)
+        self.size = 2 * 64 ** pieces
+
+    def close(self):
+        self.data.close()
+
+    def value(self, index):
+        return VALUE.unpack_from(self.data, HEADER.size + 2 * index)[0]
+
+    def index_of(self, position, flipped):
+        # With the colours swapped the board is mirrored top to bottom too,
+        # so pawns still move the way the table expects
+        black_to_move = (position.turn == 'black') != flipped
+        index = 1 if black_to_move else 0
+        for code, _ in self.groups:
+            source = code ^ BLACK if flipped else code
+            for square in sorted(square ^ 56 if flipped else square for square in position.piece_squares[source]):
+                index = index * 64 + square
+        return index
+
+
+class Tablebase:
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        self.tables = {}  # name -> Table, or None when there is no file
+        self.max_pieces = 2
+        if os.path.isdir(directory):
+            for entry in os.listdir(directory):
+                if entry.endswith('.tb'):
+                    self.max_pieces = max(self.max_pieces, len(entry) - len('.tb') - 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+    def table(self, name):
+        if name not in self.tables:
+            try:
+                self.tables[name] = Table(table_path(self.directory, name))
+            except (OSError, ValueError):
+                self.tables[name] = None
+        return self.tables[name]
+
+    def is_dead_draw(self, position):
+        # Neither side has the material to mate
+        return material_of(position)[0] in INSUFFICIENT
+
+    def probe(self, position):
+        # Probe(wdl, dtm) for the side to move, or None when the position is
+        # not covered by a table
+        if position.castling_rights or position.can_capture_en_passant():
+            return None
+        name, flipped = material_of(position)
+        if name in INSUFFICIENT:
+            return Probe(0, None)
+        if len(name) - 1 > self.max_pieces:
+            return None
+        table = self.table(name)
+        if table is None:
+            return None
+        return decode_value(table.value(table.index_of(position, flipped)))
+
+    def best_move(self, position):
+        # (move, Probe) for the move that wins fastest, draws or loses
+        # slowest, or None when the position or a reply is not covered
+        if self.probe(position) is None:
+            return None
+        best = None
+        for move in position.legal_moves():
+            position.make_move(move)
+            reply = self.probe(position)
+            position.unmake_move()
+            if reply is None:
+                return None
+            # The reply is from the opponent's side; rank our outcomes
+            wdl = -reply.wdl
+            rank = (wdl, -reply.dtm if wdl > 0 else (reply.dtm if wdl < 0 else 0))
+            if best is None or rank > best[0]:
+                outcome = Probe(wdl, None if wdl == 0 else reply.dtm + 1)
+                best = (rank, move, outcome)
+        return None if best is None else best[1:]
+
+
+def _place(position, groups, squares, black_to_move):
+    position.squares = bytearray(64)
+    square_iter = iter(squares)
+    for code, count in groups:
+        for _ in range(count):
+            position.squares[next(square_iter)] = code
+    position.turn = 'black' if black_to_move else 'white'
+    position.castling_rights = 0
+    position.en_passant_square = None
+    position.index_pieces()
+
+
+def _decode_index(index, pieces):
+    squares = []
+    for _ in range(pieces):
+        index, square = divmod(index, 64)
+        squares.append(square)
+    squares.reverse()
+    return squares, index  # index is now 1 when black is to move
+
+
+def _placement_ok(groups, squares):
+    # Distinct squares, no pawn on the first or last rank, and identical
+    # pieces in ascending square order so each placement is indexed once
+    if len(set(squares)) != len(squares):
+        return False
+    offset = 0
+    for code, count in groups:
+        group = squares[offset:offset + count]
+        if code & 7 == PAWN and any(square < 8 or square >= 56 for square in group):
+            return False
+        if any(group[i] >= group[i + 1] for i in range(count - 1)):
+            return False
+        offset += count
+    return True
+
+
+def _scan_chunk(name, directory, chunk, pieces):
+    # Forward pass over the placements whose top index digits are the chunk:
+    # legal move counts, checkmates, and the outcomes of captures and
+    # promotions, looked up in the smaller tables
+    groups = piece_groups(name)
+    span = 64 ** (pieces - 1)
+    counts = bytearray([INVALID]) * span
+    mates = []
+    conversions = []  # (index, stored value of the position after the move)
+    position = Position(setup=False)
+    with Tablebase(directory) as smaller:
+        for offset in range(span):
+            index = chunk * span + offset
+            squares, black_to_move = _decode_index(index, pieces)
+            if not _placement_ok(groups, squares):
+                continue
+            _place(position, groups, squares, black_to_move)
+            mover = position.turn
+            if position.is_king_in_check(opponent(mover)):
+                continue
+            legal = 0
+            for move in position.pseudo_legal_moves():
+                captured = position.make_move(move)
+                if position.is_king_in_check(mover):
+                    position.unmake_move()
+                    continue
+                legal += 1
+                if captured or move[2]:
+                    outcome = smaller.probe(position)
+                    if outcome is None:
+                        raise RuntimeError(f"missing table for {material_of(position)[0]}")
+                    if outcome.wdl:
+                        conversions.append((offset, encode_value(outcome)))
+                position.unmake_move()
+            counts[offset] = legal
+            if not legal and position.is_king_in_check(mover):
+                mates.append(offset)
+    return chunk, bytes(counts), mates, conversions
+
+
+def _unmoves(groups, squares, mover_bit):
+    # Squares each of the mover's pieces could have come from without a
+    # capture or promotion, as (piece position in squares, from square)
+    occupied = set(squares)
+    offset = 0
+    for code, count in groups:
+        if code & BLACK == mover_bit:
+            piece_type = code & 7
+            for slot in range(offset, offset + count):
+                square = squares[slot]
+                if piece_type == PAWN:
+                    back = 8 if mover_bit == WHITE else -8
+                    source = square + back
+                    if 8 <= source < 56 and source not in occupied:
+                        yield slot, source
+                        home = 4 if mover_bit == WHITE else 3
+                        if square // 8 == home and source + back not in occupied:
+                            yield slot, source + back
+                elif piece_type == KNIGHT or piece_type == KING:
+                    for source in (KNIGHT_HOPS if piece_type == KNIGHT else KING_HOPS)[square]:
+                        if source not in occupied:
+                            yield slot, source
+                else:
+                    for ray in SLIDER_RAYS[piece_type][square]:
+                        for source in ray:
+                            if source in occupied:
+                                break
+                            yield slot, source
+        offset += count
+
+
+def _index(groups, squares, black_to_move):
+    index = 1 if black_to_move else 0
+    offset = 0
+    for code, count in groups:
+        for square in sorted(squares[offset:offset + count]):
+            index = index * 64 + square
+        offset += count
+    return index
+
+
+def generate(name, directory=DEFAULT_DIRECTORY, workers=None, out=sys.stdout):
+    # Build the table and any smaller ones it needs; returns the file path
+    name, _ = canonical_material(*name.split('v'))
+    path = table_path(directory, name)
+    if os.path.exists(path):
+        return path
+    for smaller in sub_materials(name):
+        if smaller not in INSUFFICIENT:
+            generate(smaller, directory, workers, out)
+    os.makedirs(directory, exist_ok=True)
+
+    started = time.perf_counter()
+    groups = piece_groups(name)
+    pieces = sum(count for _, count in groups)
+    size = 2 * 64 ** pieces
+    span = 64 ** (pieces - 1)
+    counts = bytearray(size)
+    values = array.array('h', bytes(2 * size))
+    lost = collections.defaultdict(list)  # ply -> positions lost in that many plies
+    won = collections.defaultdict(list)
+    conversion_losses = collections.defaultdict(list)  # ply -> positions with a capture into a loss that long
+    conversion_wins = collections.defaultdict(list)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [pool.submit(_scan_chunk, name, directory, chunk, pieces) for chunk in range(size // span)]
+        for job in concurrent.futures.as_completed(jobs):
+            chunk, chunk_counts, mates, conversions = job.result()
+            base = chunk * span
+            counts[base:base + span] = chunk_counts
+            for offset in mates:
+                values[base + offset] = -1
+                lost[0].append(base + offset)
+            for offset, value in conversions:
+                outcome = decode_value(value)
+                (conversion_losses if outcome.wdl < 0 else conversion_wins)[outcome.dtm].append(base + offset)
+
+    # Backward pass, one ply at a time so every win is found at its shortest
+    # and every loss at its longest
+    ply = 0
+    last = max([0] + list(conversion_losses) + list(conversion_wins))
+    while ply <= last:
+        winners = conversion_losses.pop(ply, [])
+        losers = conversion_wins.pop(ply, [])
+        for source, is_loss in ((lost.pop(ply, []), True), (won.pop(ply, []), False)):
+            for index in source:
+                squares, black_to_move = _decode_index(index, pieces)
+                mover_bit = WHITE if black_to_move else BLACK
+                for slot, origin in _unmoves(groups, squares, mover_bit):
+                    previous = squares[:]
+                    previous[slot] = origin
+                    (winners if is_loss else losers).append(_index(groups, previous, not black_to_move))
+        for index in winners:
+            if values[index] == 0 and counts[index] != INVALID:
+                values[index] = ply + 2
+                won[ply + 1].append(index)
+                last = max(last, ply + 1)
+        for index in losers:
+            if values[index] == 0 and counts[index] != INVALID:
+                counts[index] -= 1
+                if counts[index] == 0:
+                    values[index] = -(ply + 2)
+                    lost[ply + 1].append(index)
+                    last = max(last, ply + 1)
+        ply += 1
+
+    if sys.byteorder == 'big':
+        values.byteswap()
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, name.encode(), pieces))
+        values.tofile(file)
+    os.replace(partial, path)
+    decided = sum(1 for value in values if value)
+    print(f"{name}: {decided} decided positions, longest mate {last} plies "
+          f"[{time.perf_counter() - started:.1f}s]", file=out)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or probe endgame tablebases.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="generate tables, and the smaller tables they need")
+    build.add_argument('material', nargs='+', help="material such as KQvK or KRPvKR")
+    build.add_argument('--dir', default=DEFAULT_DIRECTORY, help="table directory")
+    build.add_argument('--workers', type=int, default=None, help="processes for the forward pass")
+    probe = commands.add_parser('probe', help="show the result and best move for a position")
+    probe.add_argument('--fen', required=True, help="position to look up")
+    probe.add_argument('--dir', default=DEFAULT_DIRECTORY, help="table directory")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        for material in args.material:
+            generate(material, args.dir, args.workers)
+        return 0
+    with Tablebase(args.dir) as tablebase:
+        position = Position.from_fen(args.fen)
+        result = tablebase.probe(position)
+        if result is None:
+            print("not in the tablebase")
+            return 1
+        words = {1: 'win', 0: 'draw', -1: 'loss'}
+        print(f"{words[result.wdl]} for {position.turn}" + (f", mate in {result.dtm} plies" if result.wdl else ''))
+        best = tablebase.best_move(position)
+        if best is not None:
+            print(f"best move {move_to_uci(best[0])}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
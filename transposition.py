@@ -0,0 +1,59 @@
+"""Bounded transposition table keyed on Position.zobrist.
+
+The table has a fixed number of slots, so memory use doesn't grow with the
+number of positions seen.  A key maps to one slot; when two positions
+collide, the entry searched to the greater depth is kept, unless it is
+left over from an earlier search (see new_search), in which case it is
+always replaced.  Values are whatever the caller stores: evaluations,
+legal-move lists, search results.
+"""
+
+
+class TranspositionTable:
+    def __init__(self, size=1 << 16):
+        # Round down to a power of two so a key can be masked to its slot
+        slots = 1
+        while slots * 2 <= size:
+            slots *= 2
+        self.mask = slots - 1
+        self.slots = [None] * slots  # (key, depth, generation, value)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return sum(1 for entry in self.slots if entry is not None)
+
+    def __contains__(self, key):
+        entry = self.slots[key & self.mask]
+        return entry is not None and entry[0] == key
+
+    def new_search(self):
+        # Entries stored before this call become the first to be replaced
+        self.generation += 1
+
+    def clear(self):
+        self.slots = [None] * len(self.slots)
+        self.hits = 0
+        self.misses = 0
+
+    def probe(self, key):
+        # (depth, value) stored for the key, or None
+        entry = self.slots[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1], entry[3]
+        self.misses += 1
+        return None
+
+    def get(self, key, default=None):
+        found = self.probe(key)
+        return default if found is None else found[1]
+
+    def store(self, key, value, depth=0):
+        index = key & self.mask
+        entry = self.slots[index]
+        if entry is None or entry[0] == key or entry[2] != self.generation or depth >= entry[1]:
+            self.slots[index] = (key, depth, self.generation, value)
+            return True
+        return False